@@ -9,6 +9,7 @@ import matplotlib.pylab as plt
 here = os.path.dirname(__file__)
 sys.path.insert(0, here)
 from container_recorder import Traces
+from similarity import DistanceStore
 
 
 def get_parser():
@@ -27,6 +28,33 @@ def get_parser():
         default=os.path.join(here, "img"),
     )
     parser.add_argument("--name", help="Application name", default="LAMMPS")
+    parser.add_argument(
+        "--cache",
+        help="Cache parsed recordings on disk (next to each recording)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache parsed recordings in (implies --cache)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to parse recordings with",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--align",
+        help="Align path sequences before taking the edit distance (slower)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--store",
+        help="Directory to keep distances in, so only new recordings are compared",
+    )
     return parser
 
 
@@ -35,10 +63,16 @@ def main():
 
     # Extra events here should be one or more result event files to parse
     args, events = p.parse_known_args()
-    simcalc = Traces(events)
+    simcalc = Traces(
+        events, cache=args.cache, cache_dir=args.cache_dir, workers=args.jobs
+    )
     df = simcalc.to_dataframe()
     df.to_csv("testing-lammps-same.csv")
-    sims = simcalc.distance_matrix()
+    if args.store:
+        store = DistanceStore(args.store, align=args.align)
+        sims = store.distance_matrix(store.update(simcalc))
+    else:
+        sims = simcalc.distance_matrix(align=args.align)
     print(sims)
 
     # Clean up release names
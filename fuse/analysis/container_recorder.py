@@ -1,12 +1,41 @@
 #!/usr/bin/env python
 
+import datetime
+import gzip
+import hashlib
+import json
+import mmap
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pylab as plt
 import networkx as nx
 import numpy
 import pandas
 from matplotlib.colors import TwoSlopeNorm
+from scipy.spatial.distance import squareform
+
+# Powers of ten for parsing timestamps (up to 19 digits fits in int64)
+POWERS_OF_TEN = 10 ** numpy.arange(19, dtype=numpy.int64)
+
+# Parsed recordings are cached as one array (.npy) per column, so loading a
+# column memory maps just its pages. Bump the version if the format (or what
+# the parser produces) changes.
+CACHE_VERSION = 3
+CACHE_DIRNAME = ".fs-record-cache"
+CACHE_COLUMNS = {"timestamps": "<i8", "operations": "<i4", "path_ids": "<i4"}
+
+# Traceback pointers for alignments (one byte per cell of the score matrix),
+# and how many we keep at once before splitting an alignment in half
+ALIGN_DIAGONAL = 1
+ALIGN_UP = 2
+ALIGN_LEFT = 3
+ALIGN_MAX_CELLS = 2**26
+
+# Release tags (like patch_2Aug2023 or stable_2Aug2023_update1) have a date
+# and maybe an update number, and we order releases by both
+RELEASE_TAG = re.compile(r"(\d{1,2})([A-Z][a-z]{2})(\d{4})(?:_update(\d+))?")
 
 
 class Event:
@@ -19,21 +48,284 @@ class Event:
             setattr(self, key, value)
 
 
+class Recording:
+    """
+    A recording parsed into columns, one array per field.
+
+    There are no per-event objects - path_ids index into paths, a PathTable
+    that holds each unique path once. When we parse a file the table is local
+    to it, and intern moves the recording into a table shared by many files.
+    Operations are ids into functions, the function names the recording has
+    (in the order they first appear), so any function can be selected.
+    """
+
+    def __init__(self, filename, timestamps, operations, path_ids, paths, functions):
+        self.filename = filename
+        self.basename = os.path.basename(filename)
+        self.timestamps = timestamps
+        self.operations = operations
+        self.path_ids = path_ids
+        self.paths = paths
+        self.functions = functions
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def select(self, operation="Open"):
+        """
+        Return indices of events for an operation, in recorded order.
+        """
+        if operation not in self.functions:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.flatnonzero(self.operations == self.functions.index(operation))
+
+    def select_ids(self, operation="Open", remove_so_version=False):
+        """
+        Return the path ids (int32) for an operation, in recorded order.
+        """
+        ids = self.path_ids[self.select(operation)]
+        if remove_so_version:
+            ids = self.paths.normalize(ids)
+        return ids
+
+    def intern(self, table):
+        """
+        Move path ids into a shared PathTable.
+        """
+        if table is not self.paths:
+            remap = table.intern_many(self.paths.paths)
+            self.path_ids = remap[self.path_ids]
+            self.paths = table
+        return self
+
+    def iter_events(self, operation="Open"):
+        """
+        Yield event objects for an operation (one object per event).
+        """
+        for idx in self.select(operation):
+            path = self.paths[self.path_ids[idx]]
+            yield Event(
+                filename=self.filename,
+                basename=self.basename,
+                function=operation,
+                path=path,
+                timestamp=int(self.timestamps[idx]),
+                normalized_path=normalize_path(path),
+            )
+
+
+class PathTable:
+    """
+    A symbol table that gives every path a dense integer id.
+
+    Raw and normalized paths share one id space, and we only normalize each
+    unique path once: normalized[idx] is the id of the normalized path.
+    Traces can then be compact int32 arrays, and comparing two paths is
+    comparing two integers.
+    """
+
+    def __init__(self, paths=None):
+        self.paths = []
+        self.ids = {}
+        self._normalized = []
+        self._normalized_ids = numpy.zeros(0, dtype=numpy.int32)
+        self.intern_many(paths or [])
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        return self.paths[idx]
+
+    @property
+    def normalized(self):
+        """
+        Array that maps each path id to the id of its normalized path.
+        """
+        if len(self._normalized_ids) != len(self._normalized):
+            self._normalized_ids = numpy.array(self._normalized, dtype=numpy.int32)
+        return self._normalized_ids
+
+    def add(self, path):
+        """
+        Get the id for a path, adding it to the end of the table if needed.
+        """
+        idx = self.ids.get(path)
+        if idx is None:
+            idx = len(self.paths)
+            self.paths.append(path)
+            self.ids[path] = idx
+        return idx
+
+    def intern(self, path):
+        """
+        Get the id for a path, adding it (and its normalized path) if needed.
+        """
+        return int(self.intern_many([path])[0])
+
+    def intern_many(self, paths):
+        """
+        Intern a list of paths, returning an int32 array of ids.
+        """
+        ids = numpy.array([self.add(path) for path in paths], dtype=numpy.int32)
+
+        # Normalized paths are added after, so new paths get ids in the order
+        # given. A normalized path is its own normalized path.
+        while len(self._normalized) < len(self.paths):
+            path = self.paths[len(self._normalized)]
+            self._normalized.append(self.add(normalize_path(path)))
+        return ids
+
+    def normalize(self, ids):
+        """
+        Map an array of path ids to the ids of their normalized paths.
+        """
+        return self.normalized[ids]
+
+    def lookup(self, ids):
+        """
+        Get back the list of paths for an array of ids.
+        """
+        return [self.paths[idx] for idx in numpy.asarray(ids).tolist()]
+
+    def count(self, ids):
+        """
+        Count path ids, returning path -> count in order of first appearance.
+        """
+        ids = numpy.asarray(ids)
+        uniques, first, counts = numpy.unique(
+            ids, return_index=True, return_counts=True
+        )
+        return {
+            self.paths[uniques[idx]]: int(counts[idx])
+            for idx in numpy.argsort(first, kind="stable")
+        }
+
+
+class TraceStore:
+    """
+    An in-memory store of parsed recordings, so each file is parsed once.
+
+    Recordings are keyed by filename and share one PathTable. We check the
+    size and mtime of the file on each access, and only parse it again if
+    one of them has changed.
+
+    With cache=True, parsed recordings are also saved to disk next to the
+    recording (or in cache_dir), keyed by the same size and mtime. Loading
+    one memory maps a file per column, so there is nothing to parse.
+    """
+
+    def __init__(self, paths=None, cache=False, cache_dir=None):
+        self.paths = paths if paths is not None else PathTable()
+        self.cache = cache or cache_dir is not None
+        self.cache_dir = cache_dir
+        self.recordings = {}
+        self.stamps = {}
+
+    def __contains__(self, filename):
+        return filename in self.recordings
+
+    def get(self, filename):
+        """
+        Get the recording for a file, parsing it if it's new or has changed.
+        """
+        stamp = file_stamp(filename)
+        if self.stamps.get(filename) != stamp:
+            recording = read_recording(filename, stamp, self.cache, self.cache_dir)
+            self.add(recording, stamp)
+        return self.recordings[filename]
+
+    def add(self, recording, stamp):
+        """
+        Add a parsed recording, interning its paths into the shared table.
+        """
+        self.recordings[recording.filename] = recording.intern(self.paths)
+        self.stamps[recording.filename] = stamp
+
+    def load(self, filenames, workers=None):
+        """
+        Get recordings for a list of files, in the same order.
+
+        With workers, new or changed files are parsed in a process pool.
+        Results are added in the order of the files, so path ids are the
+        same as if we had parsed them one at a time.
+        """
+        stamps = [file_stamp(filename) for filename in filenames]
+        stale = [
+            (filename, stamp)
+            for filename, stamp in zip(filenames, stamps)
+            if self.stamps.get(filename) != stamp
+        ]
+        if workers and workers > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                recordings = pool.map(
+                    read_recording,
+                    [filename for filename, _ in stale],
+                    [stamp for _, stamp in stale],
+                    [self.cache] * len(stale),
+                    [self.cache_dir] * len(stale),
+                    chunksize=max(1, len(stale) // (workers * 4)),
+                )
+                for recording, (_, stamp) in zip(recordings, stale):
+                    self.add(recording, stamp)
+        return [self.get(filename) for filename in filenames]
+
+    def invalidate(self, filename=None):
+        """
+        Forget one recording (or all of them) so the next get parses again.
+        """
+        filenames = [filename] if filename else list(self.recordings)
+        for filename in filenames:
+            self.recordings.pop(filename, None)
+            self.stamps.pop(filename, None)
+
+
 class INode:
     """
     An INode is part of a Filesystem Trie
     We keep track of a count since we are going to use
     this to plot frequency of access.
+
+    It's a view of one node (an index) of the filesystem arrays, so we only
+    make one when someone asks for it.
     """
 
-    def __init__(self, name, count=0):
-        self.children = {}
-        self.name = name
-        self.count = count
+    def __init__(self, filesystem, idx):
+        self.filesystem = filesystem
+        self.idx = idx
+
+    @property
+    def name(self):
+        return self.filesystem.node_path(self.idx)
+
+    @property
+    def count(self):
+        return int(self.filesystem.counts[self.idx])
+
+    @property
+    def total(self):
+        """
+        The count of this node and everything under it.
+        """
+        return int(self.filesystem.totals[self.idx])
+
+    @property
+    def releases(self):
+        """
+        The releases that opened this path.
+        """
+        return self.filesystem.releases_of(self.filesystem.opened[self.idx])
+
+    @property
+    def children(self):
+        return {
+            self.filesystem.basename(child): INode(self.filesystem, child)
+            for child in self.filesystem.iter_children(self.idx)
+        }
 
     @property
     def basename(self):
-        return os.path.basename(self.name) or os.sep
+        return self.filesystem.basename(self.idx)
 
     @property
     def label(self):
@@ -42,19 +334,55 @@ class INode:
         return f"{self.basename}\n{self.count}"
 
     def increment(self, count):
-        self.count += count
+        self.filesystem.increment(self.idx, count)
 
 
 class Filesystem:
     """
     A Filesystem is a Trie of nodes
+
+    Nodes are indices into arrays (a struct of arrays), with the parent,
+    first and last child, and next sibling of each, and path components are
+    interned so each name is stored once. Children are found with one dict
+    keyed by an int (the parent and component). Totals are the count of a
+    node and everything under it, and are updated on insert, so the opens
+    under a directory is a lookup. Nothing here is recursive.
+
+    Paths inserted for a recording also set its bit in bitmaps (uint64
+    words, one bit per recording) for the node that was opened, and for the
+    node and every parent (under), so asking which releases opened a path,
+    or the paths only some releases opened, are word operations. Each
+    recording belongs to a release (itself, unless given), and a release
+    with many recordings (like one per rank) is the bits of all of them.
     """
 
-    def __init__(self):
-        self.root = INode(os.sep)
+    def __init__(self, capacity=1024):
+        self.names = []
+        self.name_ids = {}
+        self.child_ids = {}
+        self.parent = numpy.full(capacity, -1, dtype=numpy.int32)
+        self.first_child = numpy.full(capacity, -1, dtype=numpy.int32)
+        self.last_child = numpy.full(capacity, -1, dtype=numpy.int32)
+        self.next_sibling = numpy.full(capacity, -1, dtype=numpy.int32)
+        self.component = numpy.full(capacity, -1, dtype=numpy.int32)
+        self.counts = numpy.zeros(capacity, dtype=numpy.int64)
+        self.totals = numpy.zeros(capacity, dtype=numpy.int64)
+        self.opened = numpy.zeros((capacity, 1), dtype=numpy.uint64)
+        self.under = numpy.zeros((capacity, 1), dtype=numpy.uint64)
+        self.recordings = []
+        self.recording_ids = {}
+        self.release_recordings = {}
+        self.size = 1
         self.min_count = 0
         self.max_count = 0
 
+    def __len__(self):
+        return self.size
+
+    @property
+    def root(self):
+        return INode(self, 0)
+
     def get_graph(self, font_size=10, tree=True, node_size=1000, title=None):
         """
         Get a plot for a trie
@@ -62,10 +390,9 @@ class Filesystem:
         plt.figure(figsize=(20, 8))
         graph = nx.DiGraph()
 
-        # Recursive function to walk through root, etc.
-        color_counts = {}
-        get_counts(counts=color_counts, node=self.root)
-        add_to_graph(graph=graph, root=self.root, node=self.root)
+        # Walk through root, etc.
+        color_counts = get_counts(self)
+        add_to_graph(graph=graph, filesystem=self)
 
         # Set a filter for the highest color so it doesn't bias the entire plot
         unique_counts = list(set(list(color_counts.values())))
@@ -100,7 +427,7 @@ class Filesystem:
                 count = min_count
             if count > max_count:
                 count = max_count
-            node_colors.append(colors[count])
+            node_colors.append(colors[count - min_count])
 
         # Tree visualization (much better) requires graphviz, dot, etc.
         if tree:
@@ -134,42 +461,320 @@ class Filesystem:
         plt.tight_layout()
         return graph
 
-    def insert(self, path, count=0, remove_so_version=True):
+    def insert(
+        self, path, count=0, remove_so_version=True, recording=None, release=None
+    ):
         """
         Insert an INode into the filesystem.
 
         If we are adding a count, increment by it. We also build the tree
-        without .so.<version> to compare across.
+        without .so.<version> to compare across. If the path is from a
+        recording (name), we set its bit too, and it's part of the release.
         """
         if remove_so_version:
             path = normalize_path(path)
-        node = self.root
-        partial_path = []
-        for part in path.split(os.sep):
-            partial_path.append(part)
-            if part not in node.children:
-                assembled_path = os.sep.join(partial_path)
-                node.children[part] = INode(assembled_path)
-            node = node.children[part]
-        node.increment(count)
-
-        # Update counts
-        if node.count < self.min_count:
-            self.min_count = node.count
-        if node.count > self.max_count:
-            self.max_count = node.count
+        word, bit = None, None
+        if recording is not None:
+            word, bit = self.recording_bit(recording, release)
+        node = 0
+        self.totals[node] += count
+        if bit is not None:
+            self.under[node, word] |= bit
+        for part in split_path(path):
+            node = self.add_child(node, part)
+            self.totals[node] += count
+            if bit is not None:
+                self.under[node, word] |= bit
+        if bit is not None:
+            self.opened[node, word] |= bit
+        self.counts[node] += count
+        self.update_range(node)
+
+    def insert_recordings(self, lookup, remove_so_version=True, releases=None):
+        """
+        Insert the paths of many recordings (like Traces.as_counts).
 
-    def find(self, path):
+        Releases is a lookup of the release for each recording, if not itself.
         """
-        Search the filesystem for a path
+        releases = releases or {}
+        for recording, counts in lookup.items():
+            release = releases.get(recording)
+            for path, count in counts.items():
+                self.insert(path, count, remove_so_version, recording, release)
+
+    def recording_bit(self, recording, release=None):
+        """
+        Get the word and bit for a recording, adding it (and words) if needed.
+        """
+        idx = self.recording_ids.get(recording)
+        if idx is None:
+            idx = len(self.recordings)
+            self.recordings.append(recording)
+            self.recording_ids[recording] = idx
+            release = recording if release is None else release
+            self.release_recordings.setdefault(release, []).append(recording)
+            words = self.opened.shape[1]
+            if idx >= words * 64:
+                extra = numpy.zeros((len(self.opened), words), dtype=numpy.uint64)
+                self.opened = numpy.hstack([self.opened, extra])
+                self.under = numpy.hstack([self.under, extra])
+        return idx // 64, numpy.uint64(1 << (idx % 64))
+
+    def recording_mask(self, recordings):
+        """
+        Get a bitmap (a row of words) with the bits of some recordings set.
+        """
+        if isinstance(recordings, str):
+            recordings = [recordings]
+        mask = numpy.zeros(self.opened.shape[1], dtype=numpy.uint64)
+        for recording in recordings:
+            idx = self.recording_ids[recording]
+            mask[idx // 64] |= numpy.uint64(1 << (idx % 64))
+        return mask
+
+    def recordings_of(self, bitmap):
+        """
+        Get the recordings with a bit set in a bitmap (a row of words).
+        """
+        bits = numpy.unpackbits(
+            numpy.ascontiguousarray(bitmap, dtype="<u8").view(numpy.uint8),
+            bitorder="little",
+        )
+        return [self.recordings[idx] for idx in numpy.flatnonzero(bits)]
+
+    def release_mask(self, releases):
+        """
+        Get a bitmap with the bits of every recording of some releases set.
+        """
+        if isinstance(releases, str):
+            releases = [releases]
+        return self.recording_mask(
+            [
+                recording
+                for release in releases
+                for recording in self.release_recordings[release]
+            ]
+        )
+
+    def releases_of(self, bitmap):
+        """
+        Get the releases with a bit of any of their recordings set in a bitmap.
+        """
+        recordings = set(self.recordings_of(bitmap))
+        return [
+            release
+            for release, members in self.release_recordings.items()
+            if not recordings.isdisjoint(members)
+        ]
+
+    def releases(self, path, under=False):
+        """
+        Get the releases that opened a path (or anything under it).
+        """
+        idx = self.locate(path)
+        if idx is None:
+            return []
+        return self.releases_of((self.under if under else self.opened)[idx])
+
+    def releases_after(self, tag):
+        """
+        Get the releases after a tag (by date, then update).
+        """
+        after = release_key(tag)
+        if after is None:
+            raise ValueError(f"{tag} doesn't have a release date (like 2Aug2023)")
+        return [
+            release
+            for release in self.release_recordings
+            if (release_key(release) or after) > after
+        ]
+
+    def only_in(self, releases):
+        """
+        Get the paths that were only opened by some releases (and no others).
+        """
+        mask = self.release_mask(releases)
+        opened = self.opened[: self.size]
+        found = (opened != 0).any(axis=1) & ((opened & ~mask) == 0).all(axis=1)
+        return [self.node_path(idx) for idx in numpy.flatnonzero(found)]
+
+    def diff(self, first, second):
+        """
+        Get the paths opened by the first release(s) but not the second.
+        """
+        opened = self.opened[: self.size]
+        first = (opened & self.release_mask(first)).any(axis=1)
+        second = (opened & self.release_mask(second)).any(axis=1)
+        found = first & ~second
+        return [self.node_path(idx) for idx in numpy.flatnonzero(found)]
+
+    def insert_many(self, counts, remove_so_version=True):
+        """
+        Insert paths with counts (a dict, like Traces.all_counts).
+        """
+        for path, count in counts.items():
+            self.insert(path, count=count, remove_so_version=remove_so_version)
+
+    def add_child(self, parent, part):
+        """
+        Get the child of parent for a path component, adding it if needed.
+        """
+        component = self.name_ids.get(part)
+        if component is None:
+            component = len(self.names)
+            self.names.append(part)
+            self.name_ids[part] = component
+
+        # Components fit in 32 bits, so the parent and component are one int
+        key = (parent << 32) | component
+        child = self.child_ids.get(key)
+        if child is not None:
+            return child
+        if self.size == len(self.parent):
+            self.grow()
+        child = self.size
+        self.size += 1
+        self.parent[child] = parent
+        self.component[child] = component
+        if self.last_child[parent] < 0:
+            self.first_child[parent] = child
+        else:
+            self.next_sibling[self.last_child[parent]] = child
+        self.last_child[parent] = child
+        self.child_ids[key] = child
+        return child
+
+    def grow(self):
+        """
+        Double the size of the node arrays.
+        """
+        for name, fill in [
+            ("parent", -1),
+            ("first_child", -1),
+            ("last_child", -1),
+            ("next_sibling", -1),
+            ("component", -1),
+            ("counts", 0),
+            ("totals", 0),
+            ("opened", 0),
+            ("under", 0),
+        ]:
+            values = getattr(self, name)
+            shape = (len(values) * 2,) + values.shape[1:]
+            grown = numpy.full(shape, fill, dtype=values.dtype)
+            grown[: len(values)] = values
+            setattr(self, name, grown)
+
+    def increment(self, idx, count):
+        """
+        Add to the count of a node, and the totals of it and its parents.
+        """
+        self.counts[idx] += count
+        self.update_range(idx)
+        while idx >= 0:
+            self.totals[idx] += count
+            idx = self.parent[idx]
+
+    def update_range(self, idx):
         """
-        node = self.root
-        for part in path.split(os.sep):
-            if part not in node.children:
+        Update the min and max counts for a node that changed.
+        """
+        count = int(self.counts[idx])
+        if count < self.min_count:
+            self.min_count = count
+        if count > self.max_count:
+            self.max_count = count
+
+    def locate(self, path):
+        """
+        Get the node index for a path, or None if it isn't in the filesystem.
+        """
+        node = 0
+        for part in split_path(path):
+            component = self.name_ids.get(part)
+            if component is None:
+                return
+            node = self.child_ids.get((node << 32) | component)
+            if node is None:
                 return
-            node = node.children[part]
         return node
 
+    def find(self, path):
+        """
+        Search the filesystem for a path
+        """
+        idx = self.locate(path)
+        if idx is not None:
+            return INode(self, idx)
+
+    def longest_prefix(self, path):
+        """
+        Find the deepest node that is a prefix of path (the root at worst).
+        """
+        node = 0
+        for part in split_path(path):
+            component = self.name_ids.get(part)
+            child = None
+            if component is not None:
+                child = self.child_ids.get((node << 32) | component)
+            if child is None:
+                break
+            node = child
+        return INode(self, node)
+
+    def total(self, path):
+        """
+        Get the total count under a path (0 if it isn't in the filesystem).
+        """
+        idx = self.locate(path)
+        return 0 if idx is None else int(self.totals[idx])
+
+    def basename(self, idx):
+        if idx == 0:
+            return os.sep
+        return self.names[self.component[idx]]
+
+    def node_path(self, idx):
+        """
+        Assemble the path of a node from the components up to the root.
+        """
+        parts = []
+        while idx > 0:
+            parts.append(self.names[self.component[idx]])
+            idx = self.parent[idx]
+        return os.sep + os.sep.join(reversed(parts))
+
+    def iter_children(self, idx):
+        child = self.first_child[idx]
+        while child >= 0:
+            yield int(child)
+            child = self.next_sibling[child]
+
+    def iter_nodes(self, idx=0):
+        """
+        Yield node indices under (and including) idx, depth first.
+
+        Children are visited in the order they were added, with a stack
+        instead of recursion so deep trees are fine.
+        """
+        stack = [idx]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(self.iter_children(node))))
+
+    def ranked(self, path=os.sep, n=None):
+        """
+        Get (path, count) for paths under path, from the highest count.
+        """
+        idx = self.locate(path)
+        if idx is None:
+            return []
+        nodes = numpy.fromiter(self.iter_nodes(idx), dtype=numpy.int64)
+        nodes = nodes[self.counts[nodes] > 0]
+        nodes = nodes[numpy.argsort(-self.counts[nodes], kind="stable")][:n]
+        return [(self.node_path(node), int(self.counts[node])) for node in nodes]
+
 
 def reject_outliers(data, m=2.0):
     """
@@ -199,10 +804,23 @@ class Traces:
     Open: is when the file is read
     """
 
-    def __init__(self, files=None):
+    def __init__(
+        self, files=None, store=None, cache=False, cache_dir=None, workers=None
+    ):
         self.files = files or []
+        if store is None:
+            store = TraceStore(cache=cache, cache_dir=cache_dir)
+        self.store = store
+        self.workers = workers
         self.check()
 
+    @property
+    def paths(self):
+        """
+        The PathTable that path ids index into.
+        """
+        return self.store.paths
+
     def count(self):
         return len(self.files)
 
@@ -218,92 +836,173 @@ class Traces:
             events.append(filename)
         self.files = events
 
+    def iter_recordings(self):
+        """
+        Yield a columnar recording for each file.
+
+        Recordings come from the store, so each file is only parsed once,
+        and path ids are interned into one table (self.paths) for all traces.
+        """
+        yield from self.store.load(self.files, workers=self.workers)
+
     def iter_events(self, operation="Open"):
         """
         Iterate through files and yield event object
         """
-        for filename in self.files:
-            basename = os.path.basename(filename)
-            for line in read_file(filename).split("\n"):
-                if not line:
-                    continue
-                # date, time, golang-file  timestamp function path
-                # 2024/11/08 10:46:19 recorder.go:46: 1731062779714551943 Lookup     /etc
-                parts = [x for x in line.split() if x]
-                if parts[-2] != operation:
-                    continue
-                yield Event(
-                    filename=filename,
-                    basename=basename,
-                    function=parts[-2],
-                    path=parts[-1],
-                    timestamp=int(parts[-3]),
-                    normalized_path=normalize_path(parts[-1]),
-                )
+        for recording in self.iter_recordings():
+            yield from recording.iter_events(operation=operation)
 
-    def to_dataframe(self, operation="Open"):
+    def to_dataframe(self, operation="Open", compact=False):
         """
         Create a data frame of lookup values, we can save for later and derive paths from it.
 
         Normalized path removes the so version, if we find it. ms_in_state is milliseconds in state
         and is the time from the current event to the next, which is the time spent in that event.
+
+        Columns are built at once from the parsed recordings. By default path
+        columns are strings and ms_in_state is None for the last event of a file.
+        With compact=True, file and path columns are categorical and ms_in_state
+        is float (NaN for the last event) to keep memory bounded.
         """
-        df = pandas.DataFrame(
-            columns=[
-                "filename",
-                "basename",
-                "function",
-                "path",
-                "normalized_path",
+        recordings = list(self.iter_recordings())
+        selected = [recording.select(operation) for recording in recordings]
+        ids = concatenate_arrays(
+            [r.path_ids[idx] for r, idx in zip(recordings, selected)], numpy.int32
+        )
+        timestamps = concatenate_arrays(
+            [r.timestamps[idx] for r, idx in zip(recordings, selected)], numpy.int64
+        )
+        files = numpy.repeat(
+            numpy.arange(len(recordings)), [len(idx) for idx in selected]
+        )
+        normalized = self.paths.normalize(ids)
+
+        # The first event of a file has no previous path, and the last event
+        # has no time in state (there is no next event to end it)
+        first = numpy.ones(len(ids), dtype=bool)
+        first[1:] = files[1:] != files[:-1]
+        last = numpy.roll(first, -1)
+        previous = numpy.where(first, -1, numpy.roll(normalized, 1))
+        ms_in_state = numpy.roll(timestamps, -1) - timestamps
+
+        filenames = numpy.array([r.filename for r in recordings], dtype=object)
+        basenames = numpy.array([r.basename for r in recordings], dtype=object)
+        if compact:
+            paths = self.paths.paths
+
+            def path_column(codes):
+                column = pandas.Categorical.from_codes(codes, categories=paths)
+                return column.remove_unused_categories()
+
+            filename = pandas.Categorical(filenames[files])
+            basename = pandas.Categorical(basenames[files])
+            path = path_column(ids)
+            normalized_path = path_column(normalized)
+            previous_path = path_column(previous)
+            function = pandas.Categorical([operation] * len(ids))
+            ms_in_state = numpy.where(last, numpy.nan, ms_in_state)
+        else:
+            # Index -1 (no previous path) is the None at the end. These stay
+            # object columns (pandas would infer strings) so None stays None.
+            paths = numpy.array(self.paths.paths + [None], dtype=object)
+
+            def path_column(codes):
+                return pandas.Series(paths[codes], dtype=object)
+
+            function = pandas.Series([operation] * len(ids), dtype=object)
+            filename = pandas.Series(filenames[files], dtype=object)
+            basename = pandas.Series(basenames[files], dtype=object)
+            path = path_column(ids)
+            normalized_path = path_column(normalized)
+            previous_path = path_column(previous)
+            ms_in_state = ms_in_state.astype(object)
+            ms_in_state[last] = None
+
+        return pandas.DataFrame(
+            {
+                "filename": filename,
+                "basename": basename,
+                "function": function,
+                "path": path,
+                "normalized_path": normalized_path,
                 # This is a normalized path
-                "previous_path",
-                "timestamp",
-                "ms_in_state",
-            ]
+                "previous_path": previous_path,
+                "timestamp": timestamps,
+                "ms_in_state": ms_in_state,
+            }
         )
-        idx = 0
-        previous_timestamp = None
-        previous_path = None
-        current = None
-        for event in self.iter_events(operation=operation):
-            normalized_path = normalize_path(event.path)
-            df.loc[idx, :] = [
-                event.filename,
-                os.path.basename(event.filename),
-                event.function,
-                event.path,
-                normalized_path,
-                previous_path,
-                event.timestamp,
-                None,
-            ]
-            if current is not None and event.filename != current:
-                previous_path = None
-                previous_timestamp = None
-            if previous_timestamp is not None:
-                df.loc[idx - 1, "ms_in_state"] = event.timestamp - previous_timestamp
-            previous_timestamp = event.timestamp
-            previous_path = normalized_path
-            current = event.filename
-            idx += 1
-        return df
-
-    def distance_matrix(self, operation="Open"):
+
+    def distance_matrix(
+        self, operation="Open", workers=None, align=False, max_distance=None
+    ):
         """
         Generate pairwise distance matrix for paths
         """
-        lookup = self.as_paths(operation=operation)
-        names = list(lookup.keys())
-        df = pandas.DataFrame(index=names, columns=names)
-        for filename1 in names:
-            for filename2 in names:
-                if filename1 > filename2:
-                    continue
-                aligned1, aligned2 = align_paths(lookup[filename1], lookup[filename2])
-                distance = calculate_levenshtein(aligned1, aligned2)
-                df.loc[filename1, filename2] = float(distance)
-                df.loc[filename2, filename1] = float(distance)
-        return df
+        names, distances = self.condensed_distances(
+            operation, workers, align, max_distance
+        )
+
+        # squareform gives one cell for no distances, even with no traces
+        if len(names) < 2:
+            return pandas.DataFrame(
+                numpy.zeros((len(names), len(names))), index=names, columns=names
+            )
+        return pandas.DataFrame(squareform(distances), index=names, columns=names)
+
+    def condensed_distances(
+        self, operation="Open", workers=None, align=False, max_distance=None
+    ):
+        """
+        Generate distances for each unique pair of traces.
+
+        Returns the trace names and a float32 condensed distance array, in the
+        order of scipy.spatial.distance.squareform, so it can be given right to
+        scipy.cluster.hierarchy.linkage. Workers defaults to the Traces workers.
+
+        The distance is the edit distance between the path sequences. With
+        align=True we first align them (Needleman-Wunsch) and take the edit
+        distance of the aligned sequences, which is what we used to do. The
+        two are the same for all of our recordings, but can differ. With
+        max_distance=k, any distance over k is given as k + 1, which is much
+        faster when we only care about close traces.
+        """
+        lookup = self.as_ids(operation=operation)
+        sequences = [ids.tolist() for ids in lookup.values()]
+        distances = pairwise_distances(
+            sequences, workers or self.workers, align=align, max_distance=max_distance
+        )
+        return list(lookup), distances
+
+    def near_duplicates(self, max_distance, operation="Open", workers=None):
+        """
+        Find pairs of traces that are within max_distance edits of each other.
+
+        Most pairs are ruled out without comparing them. The edit distance is
+        at least the difference in lengths, and at least the number of paths
+        (with repeats) that one trace has more of than the other, so we only
+        compute (bounded) distances for pairs that pass both. Returns a data
+        frame with the two trace names and their distance, closest first.
+        """
+        lookup = self.as_ids(operation=operation)
+        names = list(lookup)
+        sequences = [ids.tolist() for ids in lookup.values()]
+        rows, cols = near_duplicate_candidates(list(lookup.values()), max_distance)
+        distances = pairwise_distances(
+            sequences,
+            workers or self.workers,
+            max_distance=max_distance,
+            pairs=(rows, cols),
+        )
+        keep = distances <= max_distance
+        rows, cols, distances = rows[keep], cols[keep], distances[keep]
+        order = numpy.lexsort((cols, rows, distances))
+        return pandas.DataFrame(
+            {
+                "first": [names[row] for row in rows[order]],
+                "second": [names[col] for col in cols[order]],
+                "distance": distances[order].astype(int),
+            }
+        )
 
     @property
     def samples(self):
@@ -321,23 +1020,32 @@ class Traces:
             test = paths[left_out]
             yield train, test, left_out
 
-    def as_paths(self, fullpath=False, operation="Open", remove_so_version=True):
+    def as_ids(self, fullpath=False, operation="Open", remove_so_version=True):
         """
-        Return lists of paths (lookup) corresponding to traces.
+        Return int32 arrays of path ids (lookup) corresponding to traces.
+
+        Ids index into self.paths, which is shared across all traces.
         """
         lookup = {}
-        for event in self.iter_events(operation=operation):
-            key = event.basename
+        for recording in self.iter_recordings():
+            ids = recording.select_ids(operation, remove_so_version)
+            if not len(ids):
+                continue
+            key = recording.basename
             if fullpath:
-                key = event.filename
-            if key not in lookup:
-                lookup[key] = []
-            if remove_so_version:
-                lookup[key].append(event.normalized_path)
-            else:
-                lookup[key].append(event.path)
+                key = recording.filename
+            if key in lookup:
+                ids = numpy.concatenate([lookup[key], ids])
+            lookup[key] = ids
         return lookup
 
+    def as_paths(self, fullpath=False, operation="Open", remove_so_version=True):
+        """
+        Return lists of paths (lookup) corresponding to traces.
+        """
+        lookup = self.as_ids(fullpath, operation, remove_so_version)
+        return {key: self.paths.lookup(ids) for key, ids in lookup.items()}
+
     def all_counts(self, operation="Open", remove_so_version=True):
         """
         Return lookup of all counts corresponding to traces.
@@ -345,34 +1053,17 @@ class Traces:
         Since we just have one lookup, this one is returned
         sorted.
         """
-        lookup = {}
-        for event in self.iter_events(operation=operation):
-            path = event.path
-            if remove_so_version:
-                path = event.normalized_path
-            if path not in lookup:
-                lookup[path] = 0
-            lookup[path] += 1
+        lookup = self.as_ids(True, operation, remove_so_version)
+        ids = numpy.concatenate(list(lookup.values()) or [[]]).astype(numpy.int32)
+        lookup = self.paths.count(ids)
         return dict(sorted(lookup.items(), key=lambda item: item[1], reverse=True))
 
     def as_counts(self, fullpath=False, operation="Open", remove_so_version=True):
         """
         Return lookup of counts corresponding to traces.
         """
-        lookup = {}
-        for event in self.iter_events(operation=operation):
-            key = event.basename
-            if fullpath:
-                key = event.filename
-            if event.filename not in lookup:
-                lookup[key] = {}
-            path = event.path
-            if remove_so_version:
-                path = event.normalized_path
-            if path not in lookup[key]:
-                lookup[key][path] = 0
-            lookup[key][path] += 1
-        return lookup
+        lookup = self.as_ids(fullpath, operation, remove_so_version)
+        return {key: self.paths.count(ids) for key, ids in lookup.items()}
 
 
 def read_file(filename):
@@ -381,125 +1072,887 @@ def read_file(filename):
     return content
 
 
+# Parsing helpers
+
+
+def read_compressed(filename):
+    """
+    Read the bytes of a gzip or zstandard compressed recording.
+    """
+    if filename.endswith(".gz"):
+        with gzip.open(filename, "rb") as fd:
+            return fd.read()
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError(
+            f"Reading {filename} requires zstandard (pip install zstandard)"
+        )
+    with open(filename, "rb") as fd:
+        return zstandard.ZstdDecompressor().stream_reader(fd).read()
+
+
+def cache_files(filename, cache_dir=None):
+    """
+    Get the column (.npy) files and the metadata (.json) file for a recording.
+
+    By default the cache is a hidden directory next to the recording. If we
+    put many directories into one cache_dir, the name includes a hash of the
+    directory so recordings with the same basename don't collide.
+    """
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    if cache_dir is None:
+        cache_dir = os.path.join(dirname, CACHE_DIRNAME)
+    else:
+        digest = hashlib.sha1(dirname.encode()).hexdigest()[:10]
+        basename = f"{digest}-{basename}"
+    prefix = os.path.join(cache_dir, basename)
+    columns = {column: f"{prefix}.{column}.npy" for column in CACHE_COLUMNS}
+    return columns, f"{prefix}.json"
+
+
+def read_cache(filename, stamp, cache_dir=None):
+    """
+    Load a cached recording, or None if there isn't one for this stamp.
+
+    The columns are memory mapped, so this doesn't parse (or even read) them.
+    """
+    column_files, meta_file = cache_files(filename, cache_dir)
+    try:
+        with open(meta_file, "r") as fd:
+            meta = json.loads(fd.read())
+        if meta["version"] != CACHE_VERSION or tuple(meta["stamp"]) != tuple(stamp):
+            return
+        columns = {
+            column: numpy.load(path, mmap_mode="r")
+            for column, path in column_files.items()
+        }
+        if any(len(values) != meta["events"] for values in columns.values()):
+            return
+    except (OSError, ValueError, KeyError):
+        return
+    return Recording(
+        filename=filename,
+        paths=PathTable(meta["paths"]),
+        functions=meta["functions"],
+        **columns,
+    )
+
+
+def write_cache(recording, stamp, cache_dir=None):
+    """
+    Save a parsed recording to the cache.
+
+    Files are written to a temporary name and moved into place, so a reader
+    never sees half of a file. The metadata is written last, so if it has the
+    stamp of the recording, the columns are for it too. The cache is best
+    effort - if we can't write it (e.g., a read-only directory) we just parse
+    next time.
+    """
+    column_files, meta_file = cache_files(recording.filename, cache_dir)
+    meta = {
+        "version": CACHE_VERSION,
+        "stamp": list(stamp),
+        "events": len(recording),
+        "paths": recording.paths.paths,
+        "functions": recording.functions,
+    }
+    try:
+        os.makedirs(os.path.dirname(meta_file), exist_ok=True)
+        for column, path in column_files.items():
+            array = numpy.asarray(getattr(recording, column), CACHE_COLUMNS[column])
+            replace_file(path, lambda fd: numpy.save(fd, array))
+        replace_file(meta_file, lambda fd: fd.write(json.dumps(meta).encode()))
+    except OSError:
+        pass
+
+
+def replace_file(path, write):
+    """
+    Write a file with write(fd) to a temporary name, and move it into place.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fd:
+        write(fd)
+    os.replace(tmp, path)
+
+
+def concatenate_arrays(arrays, dtype):
+    """
+    Concatenate arrays, or return an empty array of a dtype if there are none.
+    """
+    if not arrays:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.concatenate(arrays).astype(dtype, copy=False)
+
+
+def file_stamp(filename):
+    """
+    Get the size and modified time of a file, to know if it has changed.
+    """
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_recording(filename, stamp, cache=False, cache_dir=None):
+    """
+    Read a recording from the on-disk cache, or parse (and cache) it.
+
+    This is module level so we can run it in a process pool.
+    """
+    if not cache:
+        return parse_recording(filename)
+    recording = read_cache(filename, stamp, cache_dir)
+    if recording is None:
+        recording = parse_recording(filename)
+        write_cache(recording, stamp, cache_dir)
+    return recording
+
+
+def parse_recording(filename):
+    """
+    Parse a recording into columns with one scan over the raw bytes.
+
+    The file is memory mapped and tokenized with numpy, so we never split
+    lines or create objects per event. Each line looks like this, and we
+    only need the last three fields:
+
+    2024/11/08 10:46:19 recorder.go:46: 1731062779714551943 Lookup     /etc
+
+    Compressed recordings (.gz or .zst) are decompressed into memory first.
+    """
+    if filename.endswith((".gz", ".zst")):
+        content = read_compressed(filename)
+        return parse_buffer(filename, numpy.frombuffer(content, dtype=numpy.uint8))
+    with open(filename, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return parse_buffer(filename, numpy.zeros(0, dtype=numpy.uint8))
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return parse_buffer(filename, numpy.frombuffer(buffer, dtype=numpy.uint8))
+
+
+def parse_line(line):
+    """
+    Parse one line of a recording (like parse_recording, for a live stream).
+
+    Returns the timestamp, function and path, or None if it isn't an event.
+    """
+    fields = line.split()
+    if len(fields) < 3 or not fields[-3].isdigit():
+        return
+    return int(fields[-3]), fields[-2], fields[-1]
+
+
+def parse_buffer(filename, data):
+    """
+    Parse an array of bytes from a recording into a Recording.
+
+    Every array we return is a copy, so the caller can release the buffer.
+    """
+    # Tokens are runs of non-whitespace (like str.split, control characters
+    # and spaces are whitespace)
+    token = data > 32
+    starts = numpy.flatnonzero(token[1:] & ~token[:-1]) + 1
+    ends = numpy.flatnonzero(token[:-1] & ~token[1:]) + 1
+    if len(data) and token[0]:
+        starts = numpy.concatenate([[0], starts])
+    if len(data) and token[-1]:
+        ends = numpy.append(ends, len(data))
+
+    # A path is the last token before a newline (or the end of the file)
+    newlines = numpy.append(numpy.flatnonzero(data == 10), len(data))
+    last = numpy.searchsorted(starts, newlines) - 1
+    line_starts = numpy.concatenate([[-1], newlines[:-1]])
+
+    # The timestamp and function must be right before it on the same line
+    inside = last >= 2
+    last, line_starts = last[inside], line_starts[inside]
+    last = last[starts[last - 2] > line_starts]
+
+    # Fixed width windows at the end of the buffer would run past it, so those
+    # come from a small padded copy of the tail (we never copy the whole file)
+    lengths = ends - starts
+    widest = lengths[numpy.concatenate([last - 1, last])].max() if len(last) else 0
+    tail = padded_tail(data, max(bucket_width(widest), 32))
+    timestamps, valid = parse_integers(data, tail, starts[last - 2], lengths[last - 2])
+    last = last[valid]
+    timestamps = timestamps[valid]
+
+    # Intern function names and paths for the file
+    functions, operations = intern_tokens(
+        data, tail, starts[last - 1], lengths[last - 1]
+    )
+    paths, path_ids = intern_tokens(data, tail, starts[last], lengths[last])
+    return Recording(
+        filename=filename,
+        timestamps=timestamps,
+        operations=operations,
+        path_ids=path_ids,
+        paths=PathTable(paths),
+        functions=functions,
+    )
+
+
+def bucket_width(lengths):
+    """
+    Round token lengths up to a power of two (and a multiple of 8 bytes).
+    """
+    exponents = numpy.ceil(numpy.log2(numpy.maximum(lengths, 1))).astype(numpy.int64)
+    return numpy.maximum(8, numpy.left_shift(1, exponents))
+
+
+def padded_tail(data, width):
+    """
+    Copy the last width bytes of data, followed by width null bytes.
+
+    Returns the offset of the copy in data, and the copy.
+    """
+    offset = max(len(data) - width, 0)
+    return offset, numpy.concatenate([data[offset:], numpy.zeros(width, numpy.uint8)])
+
+
+def gather_windows(data, tail, starts, width):
+    """
+    Gather the width bytes at each start into an (n, width) array.
+
+    Windows that fit in data are read from it directly, and the few that run
+    past the end are read from the padded tail (offset, bytes).
+    """
+    offset, padded = tail
+    inside = starts <= len(data) - width
+    if inside.all():
+        return numpy.lib.stride_tricks.sliding_window_view(data, width)[starts]
+    windows = numpy.empty((len(starts), width), dtype=numpy.uint8)
+    if inside.any():
+        windows[inside] = numpy.lib.stride_tricks.sliding_window_view(data, width)[
+            starts[inside]
+        ]
+    windows[~inside] = numpy.lib.stride_tricks.sliding_window_view(padded, width)[
+        starts[~inside] - offset
+    ]
+    return windows
+
+
+def gather_tokens(data, tail, starts, lengths, width):
+    """
+    Gather tokens into a fixed width (n, width) array, padded with null bytes.
+    """
+    tokens = gather_windows(data, tail, starts, width)
+    tokens[numpy.arange(width) >= lengths[:, None]] = 0
+    return tokens
+
+
+def unique_tokens(tokens):
+    """
+    Find unique rows of a fixed width token array.
+
+    We hash each row (as 64-bit words) and unique the hashes, which is much
+    faster than sorting bytes. The result is checked against the rows and we
+    fall back to comparing bytes if there is ever a collision.
+    """
+    hashes = numpy.zeros(len(tokens), dtype=numpy.uint64)
+    for column in tokens.view(numpy.uint64).T:
+        hashes = (hashes ^ column) * numpy.uint64(0x100000001B3)
+    _, first, inverse = numpy.unique(hashes, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    if not (tokens == tokens[first][inverse]).all():
+        strings = tokens.view(f"S{tokens.shape[1]}").ravel()
+        _, first, inverse = numpy.unique(
+            strings, return_index=True, return_inverse=True
+        )
+        inverse = inverse.ravel()
+    return first, inverse
+
+
+def intern_tokens(data, tail, starts, lengths):
+    """
+    Assign an integer id to each token, in order of first appearance.
+
+    Returns the unique tokens (as strings) and an int32 id per token, so a
+    PathTable made from the tokens has the same ids.
+    Tokens are bucketed by length (powers of two) so that one long path
+    doesn't set the width for everything else.
+    """
+    ids = numpy.zeros(len(starts), dtype=numpy.int64)
+    buckets = bucket_width(lengths)
+    uniques = []
+    firsts = []
+    for width in numpy.unique(buckets):
+        members = numpy.flatnonzero(buckets == width)
+        tokens = gather_tokens(data, tail, starts[members], lengths[members], width)
+        first, inverse = unique_tokens(tokens)
+        ids[members] = inverse + len(uniques)
+        uniques += [token.tobytes().rstrip(b"\0").decode() for token in tokens[first]]
+        firsts.append(members[first])
+
+    # Renumber so ids follow the order tokens first appear in the file
+    if not uniques:
+        return [], ids.astype(numpy.int32)
+    order = numpy.argsort(numpy.concatenate(firsts), kind="stable")
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    return [uniques[idx] for idx in order], rank[ids].astype(numpy.int32)
+
+
+def parse_integers(data, tail, starts, lengths):
+    """
+    Parse tokens of digits into int64, returning values and a valid mask.
+
+    Timestamps almost always have the same number of digits, so we parse
+    one group per length as a matrix product with powers of ten. Anything
+    that isn't 1-19 digits (too big for int64) is marked invalid.
+    """
+    values = numpy.zeros(len(starts), dtype=numpy.int64)
+    valid = (lengths > 0) & (lengths <= 19)
+    for length in numpy.unique(lengths[valid]):
+        members = numpy.flatnonzero(lengths == length)
+
+        # Bytes below "0" wrap around, so one comparison finds non-digits
+        digits = gather_windows(data, tail, starts[members], length) - numpy.uint8(48)
+        valid[members] = (digits <= 9).all(axis=1)
+        values[members] = digits.astype(numpy.int64) @ POWERS_OF_TEN[length - 1 :: -1]
+    return values, valid
+
+
 # Plotting helpers
 
 
-def add_to_graph(graph, root, node, parent=None):
+def add_to_graph(graph, filesystem):
     """
-    Helper function to add node to graph
+    Helper function to add the nodes of a filesystem to graph
     """
-    if node != root:
+    for node in filesystem.iter_nodes():
+        if node == 0:
+            continue
+        name = filesystem.basename(node)
+        parent = filesystem.basename(filesystem.parent[node])
+
         # This is probably a bug, just skip for now
-        if node.basename != parent.basename:
-            graph.add_edge(parent.basename, node.basename)
-    for path, child in node.children.items():
-        add_to_graph(graph=graph, root=root, node=child, parent=node)
+        if name != parent:
+            graph.add_edge(parent, name)
 
 
 def derive_node_colors(min_count, max_count):
     """
     Given the min, max, and a center, return a range of colors
     """
-    palette = plt.cm.get_cmap("viridis")
-    center = int(abs(max_count - min_count) / 2)
+    palette = plt.get_cmap("viridis")
+    center = min_count + int(abs(max_count - min_count) / 2)
     norm = TwoSlopeNorm(vmin=min_count, vcenter=center, vmax=max_count)
     return [palette(norm(c)) for c in range(min_count, max_count)]
 
 
-def get_counts(counts={}, node=None):
+def get_counts(filesystem):
     """
     Get a flat list of counts
     """
-    for path, child in node.children.items():
-        counts[path] = child.count
-        get_counts(counts, child)
+    return {
+        filesystem.basename(node): int(filesystem.counts[node])
+        for node in filesystem.iter_nodes()
+        if node != 0
+    }
+
+
+def release_key(name):
+    """
+    Get the release date and update number from a tag (or recording name).
+
+    This is None if the name doesn't have a date.
+    """
+    match = RELEASE_TAG.search(name)
+    if not match:
+        return
+    day, month, year, update = match.groups()
+    date = datetime.datetime.strptime(f"{day}{month}{year}", "%d%b%Y").date()
+    return date, int(update or 0)
+
+
+def split_path(path):
+    """
+    Split a path into components, without empty ones (from / or //).
+    """
+    return [part for part in path.split(os.sep) if part]
 
 
 # Alignment helpers
 
+# Sequences for a distance worker process, set once when the pool starts
+pool_sequences = None
+
+
+def pairwise_distances(
+    sequences,
+    workers=None,
+    chunks_per_worker=4,
+    align=False,
+    max_distance=None,
+    pairs=None,
+):
+    """
+    Compute the distance between each unique pair of sequences.
+
+    We only do the n(n-1)/2 pairs in the upper triangle, and write them into
+    a float32 condensed array. Pairs can also be given as (rows, columns)
+    arrays, and then we return their distances in the same order. Pairs are sorted by cost (the product of the
+    lengths) and dealt round robin into chunks, so every chunk has a similar
+    mix of big and small alignments. There are a few chunks per worker so a
+    worker that finishes early can pick up more.
+    """
+    if pairs is None:
+        rows, cols = numpy.triu_indices(len(sequences), k=1)
+    else:
+        rows, cols = pairs
+    distances = numpy.zeros(len(rows), dtype=numpy.float32)
+    if not len(rows):
+        return distances
+
+    workers = workers or 1
+    lengths = numpy.array([len(sequence) for sequence in sequences])
+    order = numpy.argsort(-(lengths[rows] * lengths[cols]), kind="stable")
+    nchunks = min(len(order), workers * chunks_per_worker)
+    chunks = [order[start::nchunks] for start in range(nchunks)]
+    tasks = [(rows[chunk], cols[chunk], align, max_distance) for chunk in chunks]
+
+    if workers == 1:
+        set_pool_sequences(sequences)
+        results = map(distance_chunk, tasks)
+        for chunk, values in zip(chunks, results):
+            distances[chunk] = values
+        return distances
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=set_pool_sequences, initargs=(sequences,)
+    ) as pool:
+        for chunk, values in zip(chunks, pool.map(distance_chunk, tasks)):
+            distances[chunk] = values
+    return distances
+
+
+def set_pool_sequences(sequences):
+    """
+    Give a worker the sequences, so chunks only need to send indices.
+    """
+    global pool_sequences
+    pool_sequences = sequences
+
+
+def distance_chunk(task):
+    """
+    Compute distances for a chunk of (row, column) pairs of pool_sequences.
+    """
+    rows, cols, align, max_distance = task
+    return [
+        sequence_distance(pool_sequences[row], pool_sequences[col], align, max_distance)
+        for row, col in zip(rows.tolist(), cols.tolist())
+    ]
+
+
+def sequence_distance(paths1, paths2, align=False, max_distance=None):
+    """
+    Get the Levenshtein distance between two lists of path ids.
+
+    If align is True, align them first and compare the aligned lists. With a
+    max_distance, anything further than that is max_distance + 1.
+    """
+    if max_distance is not None and abs(len(paths1) - len(paths2)) > max_distance:
+        return max_distance + 1
+    if align:
+        paths1, paths2 = align_paths(paths1, paths2, gap=-1)
+    if max_distance is not None:
+        return bounded_edit_distance(paths1, paths2, max_distance)
+    return edit_distance(paths1, paths2)
+
 
-def align_paths(paths1, paths2, match_score=1, mismatch_score=-1, gap_penalty=-1):
+def near_duplicate_candidates(sequences, max_distance, chunk_size=4096):
+    """
+    Get (rows, columns) of pairs of id arrays that could be max_distance apart.
+
+    A pair needs at least as many edits as the larger of the number of ids
+    only the first has extra of, and only the second has (with repeats), so
+    we compare histograms of ids. Pairs are first limited to lengths within
+    max_distance, by sorting on length.
+    """
+    lengths = numpy.array([len(ids) for ids in sequences], dtype=numpy.int64)
+    order = numpy.argsort(lengths, kind="stable")
+    reach = numpy.searchsorted(lengths[order], lengths[order] + max_distance, "right")
+    starts = numpy.arange(len(order)) + 1
+    counts = numpy.maximum(reach - starts, 0)
+    first = numpy.repeat(order, counts)
+    second = order[
+        numpy.repeat(starts - numpy.cumsum(counts) + counts, counts)
+        + numpy.arange(counts.sum())
+    ]
+    rows = numpy.minimum(first, second)
+    cols = numpy.maximum(first, second)
+    if not len(rows):
+        return rows, cols
+
+    # Histograms of ids (renumbered to the ids that we see)
+    ids, inverse = numpy.unique(
+        concatenate_arrays(sequences, numpy.int32), return_inverse=True
+    )
+    trace = numpy.repeat(numpy.arange(len(sequences)), lengths)
+    histograms = numpy.zeros((len(sequences), len(ids)), dtype=numpy.int32)
+    numpy.add.at(histograms, (trace, inverse), 1)
+
+    keep = numpy.zeros(len(rows), dtype=bool)
+    for start in range(0, len(rows), chunk_size):
+        end = start + chunk_size
+        difference = histograms[rows[start:end]] - histograms[cols[start:end]]
+        extra = numpy.maximum(difference, 0).sum(axis=1)
+        missing = numpy.maximum(-difference, 0).sum(axis=1)
+        keep[start:end] = numpy.maximum(extra, missing) <= max_distance
+    order = numpy.lexsort((cols[keep], rows[keep]))
+    return rows[keep][order], cols[keep][order]
+
+
+def align_paths(
+    paths1,
+    paths2,
+    match_score=1,
+    mismatch_score=-1,
+    gap_penalty=-1,
+    gap="",
+    max_cells=ALIGN_MAX_CELLS,
+):
     """
     This is a hacked Needleman-Wunsch algorithm for global sequence alignment,
     but instead of handling a sequence (string) we do two lists of paths
-    """
-    # Initialize the scoring matrix
-    rows = len(paths1) + 1
-    cols = len(paths2) + 1
-    matrix = [[0 for _ in range(cols)] for _ in range(rows)]
-
-    # Fill the first row and column with gap penalties
-    for i in range(1, rows):
-        matrix[i][0] = matrix[i - 1][0] + gap_penalty
-    for j in range(1, cols):
-        matrix[0][j] = matrix[0][j - 1] + gap_penalty
-
-    # Calculate the scores for the rest of the matrix
-    for i in range(1, rows):
-        for j in range(1, cols):
-            match = matrix[i - 1][j - 1] + (
-                match_score if paths1[i - 1] == paths2[j - 1] else mismatch_score
-            )
-            delete = matrix[i - 1][j] + gap_penalty
-            insert = matrix[i][j - 1] + gap_penalty
-            matrix[i][j] = max(match, delete, insert)
 
-    # Backtrack to find the optimal alignment
+    The lists can also be interned path ids, in which case use a gap that
+    is not an id (e.g., -1).
+
+    The score matrix is filled with numpy one anti-diagonal at a time, and we
+    only keep a traceback pointer (one byte) per cell. If that is more than
+    max_cells, we split the rows in half and keep one row of scores instead
+    (see trace_alignment), so long recordings use linear memory and still get
+    exactly the same alignment.
+    """
+    symbols1, symbols2 = alignment_symbols(paths1, paths2)
+    scores = numpy.array([match_score, mismatch_score, gap_penalty])
+    top = numpy.arange(len(paths2) + 1, dtype=scores.dtype) * gap_penalty
+
+    # Moves from the end back to the start, and then the rest of the first row
+    moves = []
+    column = trace_alignment(
+        symbols1, symbols2, 0, len(paths1), len(paths2), top, scores, moves, max_cells
+    )
+    moves.extend([ALIGN_LEFT] * column)
+
+    # Walk the moves forward to build the alignment
     alignment1 = []
     alignment2 = []
-    i = rows - 1
-    j = cols - 1
-    while i > 0 or j > 0:
-        if (
-            i > 0
-            and j > 0
-            and matrix[i][j]
-            == matrix[i - 1][j - 1]
-            + (match_score if paths1[i - 1] == paths2[j - 1] else mismatch_score)
-        ):
-            alignment1 = [paths1[i - 1]] + alignment1
-            alignment2 = [paths2[j - 1]] + alignment2
-            i -= 1
-            j -= 1
-        elif i > 0 and matrix[i][j] == matrix[i - 1][j] + gap_penalty:
-            alignment1 = [paths1[i - 1]] + alignment1
-            alignment2 = [""] + alignment2
-            i -= 1
+    i = 0
+    j = 0
+    for move in reversed(moves):
+        if move == ALIGN_DIAGONAL:
+            alignment1.append(paths1[i])
+            alignment2.append(paths2[j])
+            i += 1
+            j += 1
+        elif move == ALIGN_UP:
+            alignment1.append(paths1[i])
+            alignment2.append(gap)
+            i += 1
         else:
-            alignment1 = [""] + alignment1
-            alignment2 = [paths2[j - 1]] + alignment2
-            j -= 1
-
+            alignment1.append(gap)
+            alignment2.append(paths2[j])
+            j += 1
     return alignment1, alignment2
 
 
+def alignment_symbols(paths1, paths2):
+    """
+    Give each distinct path (or id) an integer, so numpy can compare them.
+    """
+    codes = {}
+    symbols1 = numpy.fromiter(
+        (codes.setdefault(path, len(codes)) for path in paths1),
+        dtype=numpy.int64,
+        count=len(paths1),
+    )
+    symbols2 = numpy.fromiter(
+        (codes.setdefault(path, len(codes)) for path in paths2),
+        dtype=numpy.int64,
+        count=len(paths2),
+    )
+    return symbols1, symbols2
+
+
+def trace_alignment(
+    symbols1, symbols2, start, stop, end, top, scores, moves, max_cells
+):
+    """
+    Trace back from cell (stop, end) of the score matrix to row start.
+
+    Top is the row of scores at row start (columns 0 to end). Moves are
+    appended to moves, and we return the column the trace reaches row start.
+
+    If the pointers for these rows would be too big, we fill scores down to
+    the middle row, trace the bottom half from there, and then the top half
+    up to the column where the bottom half came in. This is like Hirschberg,
+    but Hirschberg picks the middle column by the best total score, which can
+    be a different (tied) alignment than the traceback would give.
+    """
+    rows = stop - start
+    if not rows:
+        return end
+
+    if rows == 1 or (rows + 1) * (end + 1) <= max_cells:
+        pointers = numpy.zeros((rows + 1, end + 1), dtype=numpy.uint8)
+        fill_alignment(
+            symbols1[start:stop], symbols2[:end], top, start, scores, pointers
+        )
+        pointers = memoryview(pointers.reshape(-1))
+        i = rows
+        j = end
+        while i > 0:
+            move = pointers[i * (end + 1) + j]
+            moves.append(move)
+            if move == ALIGN_DIAGONAL:
+                i -= 1
+                j -= 1
+            elif move == ALIGN_UP:
+                i -= 1
+            else:
+                j -= 1
+        return j
+
+    middle = start + rows // 2
+    row = fill_alignment(symbols1[start:middle], symbols2[:end], top, start, scores)
+    column = trace_alignment(
+        symbols1, symbols2, middle, stop, end, row, scores, moves, max_cells
+    )
+    return trace_alignment(
+        symbols1,
+        symbols2,
+        start,
+        middle,
+        column,
+        top[: column + 1],
+        scores,
+        moves,
+        max_cells,
+    )
+
+
+def fill_alignment(symbols1, symbols2, top, offset, scores, pointers=None):
+    """
+    Fill the alignment scores below a known top row, by anti-diagonals.
+
+    Cells on an anti-diagonal only depend on the two before it, so each one is
+    a few numpy operations. Offset is the row of the top row in the full score
+    matrix (for the gap penalties down the first column). We return the last
+    row of scores, and set traceback pointers if they are given. Ties go to
+    the diagonal, then up, then left, like the original traceback.
+    """
+    match_score, mismatch_score, gap_penalty = scores
+    rows, cols = len(symbols1), len(symbols2)
+    if not rows:
+        return top.copy()
+
+    reverse2 = symbols2[::-1]
+    previous2 = numpy.zeros(rows + 1, dtype=top.dtype)
+    previous1 = numpy.zeros(rows + 1, dtype=top.dtype)
+    current = numpy.zeros(rows + 1, dtype=top.dtype)
+    last = numpy.zeros(cols + 1, dtype=top.dtype)
+    flat = None if pointers is None else pointers.reshape(-1)
+    previous1[0] = top[0]
+
+    # Each diagonal is indexed by row, and cell (i, j) is flat[i * cols + d]
+    for diagonal in range(1, rows + cols + 1):
+        first = max(1, diagonal - cols)
+        final = min(rows, diagonal - 1)
+        if first <= final:
+            same = (
+                symbols1[first - 1 : final]
+                == reverse2[cols - diagonal + first : cols - diagonal + final + 1]
+            )
+            match = previous2[first - 1 : final] + numpy.where(
+                same, match_score, mismatch_score
+            )
+            delete = previous1[first - 1 : final] + gap_penalty
+            insert = previous1[first : final + 1] + gap_penalty
+            best = numpy.maximum(numpy.maximum(match, delete), insert)
+            current[first : final + 1] = best
+            if flat is not None:
+                flat[first * cols + diagonal : final * cols + diagonal + 1 : cols] = (
+                    numpy.where(
+                        best == match,
+                        ALIGN_DIAGONAL,
+                        numpy.where(best == delete, ALIGN_UP, ALIGN_LEFT),
+                    )
+                )
+
+        # The top row is given, and the first column is all gaps
+        if diagonal <= cols:
+            current[0] = top[diagonal]
+        if diagonal <= rows:
+            current[diagonal] = (offset + diagonal) * gap_penalty
+            if flat is not None:
+                flat[diagonal * (cols + 1)] = ALIGN_UP
+        if diagonal >= rows:
+            last[diagonal - rows] = current[rows]
+        previous2, previous1, current = previous1, current, previous2
+    return last
+
+
 def calculate_levenshtein(paths1, paths2):
     """
     Calculate Levenshtein distance between two sets of paths.
     They should already be aligned so we can compare the
     entries directly.
 
-    For each, we save the pattern as a recording of whether the
-    path is considered a deletion, insertion, or sub.
+    This used to fill the full dynamic programming matrix, and
+    now uses the bit-parallel edit_distance (same result).
+    """
+    return edit_distance(paths1, paths2)
+
+
+def edit_distance(paths1, paths2, max_distance=None):
+    """
+    Levenshtein distance between two sequences (e.g., path ids).
+
+    This is the bit-parallel algorithm of Myers (1999), as written by Hyyrö
+    for edit distance. Each column of the dynamic programming matrix is kept
+    as bit vectors of +1/-1 vertical deltas, and Python integers are bit
+    vectors of any length, so one column is a handful of big integer
+    operations instead of a loop over the other sequence. Symbols have to be
+    hashable (for the bit masks), and sequences of anything else (like lists)
+    fall back to diagonal_edit_distance.
+
+    With max_distance, we stop as soon as the distance has to be more than
+    it, and then the score we return is only known to be over max_distance
+    (bounded_edit_distance clamps it).
+    """
+    paths1, paths2 = trim_common(paths1, paths2)
+
+    # The longer sequence is the bit vectors, so we loop over the shorter one
+    if len(paths1) < len(paths2):
+        paths1, paths2 = paths2, paths1
+    size = len(paths1)
+    if not len(paths2):
+        return size
+
+    # A bit mask of positions for each symbol in the longer sequence
+    positions = {}
+    try:
+        for i, path in enumerate(paths1):
+            positions[path] = positions.get(path, 0) | (1 << i)
+        for path in paths2:
+            hash(path)
+    except TypeError:
+        return diagonal_edit_distance(paths1, paths2)
+
+    # The score is the last row, and each column left can lower it by one
+    mask = (1 << size) - 1
+    last = 1 << (size - 1)
+    plus = mask
+    minus = 0
+    score = size
+    remaining = len(paths2)
+    for path in paths2:
+        match = positions.get(path, 0)
+        vertical = match | minus
+        horizontal = (((match & plus) + plus) ^ plus) | match
+        hplus = minus | (~(horizontal | plus) & mask)
+        hminus = plus & horizontal
+        if hplus & last:
+            score += 1
+        elif hminus & last:
+            score -= 1
+        hplus = ((hplus << 1) | 1) & mask
+        hminus = (hminus << 1) & mask
+        plus = hminus | (~(vertical | hplus) & mask)
+        minus = hplus & vertical
+        remaining -= 1
+        if max_distance is not None and score - remaining > max_distance:
+            return score - remaining
+    return score
+
+
+def bounded_edit_distance(paths1, paths2, max_distance):
+    """
+    Levenshtein distance if it is at most max_distance, otherwise max_distance + 1.
+
+    This is edit_distance stopping early: the score in the last row can only
+    go down by one for each column left, so once it is more than that over
+    max_distance we are done. Far apart sequences stop after about
+    max_distance columns, and close ones cost the same as edit_distance.
+    """
+    over = max_distance + 1
+    if abs(len(paths1) - len(paths2)) > max_distance:
+        return over
+    return min(edit_distance(paths1, paths2, max_distance), over)
+
+
+def trim_common(paths1, paths2):
+    """
+    Remove the prefix and suffix two sequences share (they cost no edits).
     """
-    len1, len2 = len(paths1), len(paths2)
+    start = 0
+    end1, end2 = len(paths1), len(paths2)
+    while start < end1 and start < end2 and paths1[start] == paths2[start]:
+        start += 1
+    while end1 > start and end2 > start and paths1[end1 - 1] == paths2[end2 - 1]:
+        end1 -= 1
+        end2 -= 1
+    return paths1[start:end1], paths2[start:end2]
 
-    # Create a matrix of zeros with dimensions (len1 + 1, len2 + 1)
-    matrix = [[0] * (len2 + 1) for _ in range(len1 + 1)]
 
-    # Initialize the first row and column
-    for i in range(len1 + 1):
-        matrix[i][0] = i
-    for j in range(len2 + 1):
-        matrix[0][j] = j
+def diagonal_edit_distance(paths1, paths2):
+    """
+    Levenshtein distance with numpy, one anti-diagonal at a time.
 
-    # Fill the matrix
-    for i in range(1, len1 + 1):
-        for j in range(1, len2 + 1):
-            cost = 0 if paths1[i - 1] == paths2[j - 1] else 1
-            matrix[i][j] = min(
-                matrix[i - 1][j] + 1,  # Deletion
-                matrix[i][j - 1] + 1,  # Insertion
-                matrix[i - 1][j - 1] + cost,  # Substitution
+    Every cell on an anti-diagonal (i + j = d) only needs the two diagonals
+    before it, so each diagonal is a few vectorized operations. This is the
+    fallback edit_distance uses for symbols that aren't hashable, and takes
+    numpy arrays as they are (anything else is compared as Python objects).
+    """
+    paths1 = symbol_array(paths1)
+    reverse2 = symbol_array(paths2)[::-1]
+    len1, len2 = len(paths1), len(reverse2)
+    if not len1 or not len2:
+        return len1 + len2
+
+    # Each diagonal is indexed by i. We rotate three buffers, and only ever
+    # read cells that are valid on the previous two diagonals.
+    previous2 = numpy.zeros(len1 + 1, dtype=numpy.int64)
+    previous1 = numpy.ones(len1 + 1, dtype=numpy.int64)
+    current = numpy.zeros(len1 + 1, dtype=numpy.int64)
+    for diagonal in range(2, len1 + len2 + 1):
+        # Interior cells (i >= 1 and j >= 1) of this diagonal
+        first = max(1, diagonal - len2)
+        last = min(len1, diagonal - 1)
+        if first <= last:
+            cost = (
+                paths1[first - 1 : last]
+                != reverse2[len2 - diagonal + first : len2 - diagonal + last + 1]
+            )
+            current[first : last + 1] = numpy.minimum(
+                numpy.minimum(previous1[first - 1 : last], previous1[first : last + 1])
+                + 1,
+                previous2[first - 1 : last] + cost,
             )
-    return matrix[-1][-1]
+
+        # Edges of the matrix (j = 0 or i = 0) are the diagonal itself
+        if diagonal <= len1:
+            current[diagonal] = diagonal
+        if diagonal <= len2:
+            current[0] = diagonal
+        previous2, previous1, current = previous1, current, previous2
+    return int(previous1[len1])
+
+
+def symbol_array(paths):
+    """
+    Make a one dimensional array of symbols (objects, unless already an array).
+
+    numpy.asarray would turn a list of lists into a two dimensional array, so
+    symbols that are sequences stay whole as objects.
+    """
+    if isinstance(paths, numpy.ndarray):
+        return paths
+    symbols = numpy.empty(len(paths), dtype=object)
+    symbols[:] = list(paths)
+    return symbols
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+import pandas
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+from container_recorder import Traces
+from prefetch import build_manifest, first_opens, release_name, simulate
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate prefetch manifests from recordings",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--outdir",
+        help="Directory to write a manifest (csv) for each release, and combined",
+    )
+    parser.add_argument(
+        "--min-weight",
+        help="Leave out files opened by less than this fraction of releases",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--max-lead",
+        help="Longest time (ms) to expect reading a file to take (default 10)",
+        type=float,
+        default=10.0,
+    )
+    parser.add_argument(
+        "--simulate",
+        help="Recording to replay against the combined manifest of other releases",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Manifest (csv) to replay recordings against, instead of the others",
+    )
+    parser.add_argument(
+        "--streams",
+        help="Number of files to read ahead at once in the simulation",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--cache",
+        help="Cache parsed recordings on disk (next to each recording)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache parsed recordings in (implies --cache)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to parse recordings with",
+        type=int,
+        default=None,
+    )
+    return parser
+
+
+def main():
+    p = get_parser()
+
+    # Extra events here are the recordings to build manifests from
+    args, events = p.parse_known_args()
+    if not events and not (args.simulate and args.manifest):
+        sys.exit("Give recordings to build manifests from.")
+
+    traces = Traces(
+        events, cache=args.cache, cache_dir=args.cache_dir, workers=args.jobs
+    )
+    opens = first_opens(traces.to_dataframe(compact=True))
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+        releases = list(opens["release"].unique()) + [None]
+        for release in releases:
+            manifest = build_manifest(opens, release, args.min_weight, args.max_lead)
+            filename = os.path.join(args.outdir, f"{release or 'combined'}.csv")
+            manifest.to_csv(filename, index=False)
+        print(f"Wrote {len(releases)} manifests to {args.outdir}")
+
+    given = pandas.read_csv(args.manifest) if args.manifest else None
+    for recording in args.simulate:
+        recorded = Traces([recording], cache=args.cache, cache_dir=args.cache_dir)
+        replay = first_opens(recorded.to_dataframe())
+        name = os.path.basename(recording)
+        release = release_name(name)
+
+        # Without a manifest, we use the other releases (so no peeking)
+        manifest = given
+        if manifest is None:
+            manifest = build_manifest(
+                opens[opens["release"] != release],
+                min_weight=args.min_weight,
+                max_lead=args.max_lead,
+            )
+        result = simulate(manifest, replay, args.streams, args.max_lead)
+        print(
+            f"\n{name}: {result['startup_ms']:.2f}ms startup, "
+            f"{result['saved_ms']:.2f}ms saved ({result['estimated_ms']:.2f}ms)\n"
+            f"  {result['files']} files: {result['hits']} ready, "
+            f"{result['partial']} partly ready, {result['missed']} missed, "
+            f"and {result['wasted']} read ahead but not opened"
+        )
+
+
+if __name__ == "__main__":
+    main()
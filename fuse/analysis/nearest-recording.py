@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+from container_recorder import Traces
+from similarity import VPTree
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Find the recordings most similar to a new recording",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--index",
+        help="Nearest neighbor index to save (or load, without recordings)",
+    )
+    parser.add_argument(
+        "--query",
+        help="New recording(s) to find the nearest recordings for",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "-k",
+        help="Number of nearest recordings to show",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "--radius",
+        help="Show all recordings within this distance instead",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--cache",
+        help="Cache parsed recordings on disk (next to each recording)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache parsed recordings in (implies --cache)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to parse recordings with",
+        type=int,
+        default=None,
+    )
+    return parser
+
+
+def main():
+    p = get_parser()
+
+    # Extra events here are the recordings to build the index from
+    args, events = p.parse_known_args()
+    if not events and not args.index:
+        sys.exit("Give recordings to build an index from, or an --index to load.")
+
+    # Without an --index, the index we build is only used for these queries
+    if events:
+        traces = Traces(
+            events, cache=args.cache, cache_dir=args.cache_dir, workers=args.jobs
+        )
+        tree = VPTree.from_traces(traces)
+        if args.index:
+            tree.save(args.index)
+            print(f"Saved index of {len(events)} recordings to {args.index}")
+    else:
+        tree = VPTree.load(args.index)
+
+    for query in args.query:
+        traces = Traces([query], cache=args.cache, cache_dir=args.cache_dir)
+        paths = sum(traces.as_paths(operation=tree.operation).values(), [])
+        tree.evaluations = 0
+        if args.radius is not None:
+            results = tree.within(paths, args.radius)
+        else:
+            results = tree.nearest(paths, args.k)
+        print(f"\n{query} ({tree.evaluations} of {len(tree)} traces compared)")
+        for name, distance in results:
+            print(f"  {distance:>5} {name}")
+
+
+if __name__ == "__main__":
+    main()
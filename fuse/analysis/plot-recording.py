@@ -11,6 +11,7 @@ import seaborn as sns
 here = os.path.dirname(__file__)
 sys.path.insert(0, here)
 from container_recorder import Filesystem, Traces
+from prefetch import release_name
 
 
 def get_parser():
@@ -25,12 +26,39 @@ def get_parser():
         default=os.path.join(here, "img"),
     )
     parser.add_argument("--name", help="Application name", default="LAMMPS")
+    parser.add_argument(
+        "--cache",
+        help="Cache parsed recordings on disk (next to each recording)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache parsed recordings in (implies --cache)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to parse recordings with",
+        type=int,
+        default=None,
+    )
     parser.add_argument(
         "-n",
         help="Plot the top N paths",
         type=int,
         default=None,
     )
+    parser.add_argument(
+        "--after",
+        help="Show paths only opened by releases after this tag (like patch_2Aug2023)",
+    )
+    parser.add_argument(
+        "--diff",
+        help="Show paths opened by one release and not the other",
+        nargs=2,
+        metavar=("FIRST", "SECOND"),
+    )
     return parser
 
 
@@ -43,7 +71,9 @@ def main():
     if not os.path.exists(args.outdir):
         os.makedirs(args.outdir)
 
-    simcalc = Traces(events)
+    simcalc = Traces(
+        events, cache=args.cache, cache_dir=args.cache_dir, workers=args.jobs
+    )
 
     # Get all counts so we can get the top N (if specified) across them
     counts = simcalc.all_counts()
@@ -110,6 +140,41 @@ def main():
     inode = fs.find("/opt/lammps/examples/reaxff/HNS/ffield.reax.hns")
     print(f"{inode.name} is recorded {inode.count} times across recordings.")
 
+    # Totals are kept for every directory, so this is a lookup
+    total = fs.total("/usr/lib/x86_64-linux-gnu")
+    print(f"/usr/lib/x86_64-linux-gnu has {total} recorded opens under it.")
+
+    # Each recording sets its bit for the paths it opened, and recordings are
+    # grouped by release, so we can ask which releases opened a path, or
+    # compare releases, without a table per file
+    lookup = simcalc.as_counts(fullpath=True)
+    releases = Filesystem()
+    releases.insert_recordings(
+        lookup,
+        releases={name: release_name(os.path.basename(name)) for name in lookup},
+    )
+    path = "/opt/lammps/examples/reaxff/HNS/in.reaxff.hns"
+    opened = releases.releases(path)
+    total = len(releases.release_recordings)
+    print(f"{path} is opened by {len(opened)} of {total} releases.")
+
+    if args.after:
+        after = releases.releases_after(args.after)
+        print(f"\nPaths only opened by the {len(after)} releases after {args.after}:")
+        for path in releases.only_in(after):
+            print(f"  {path}")
+
+    if args.diff:
+        missing = [
+            name for name in args.diff if name not in releases.release_recordings
+        ]
+        if missing:
+            sys.exit(f"There are no recordings for {', '.join(missing)}")
+        for first, second in [args.diff, reversed(args.diff)]:
+            print(f"\nPaths opened by {first} and not {second}:")
+            for path in releases.diff(first, second):
+                print(f"  {path}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+
+import numpy
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+from container_recorder import parse_line
+from prediction import TransitionModel
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Predict the next files opened from a live recording",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "model",
+        help="Model directory saved by run-models.py --save-model",
+    )
+    parser.add_argument(
+        "--follow",
+        help="Recording to follow as it is written (default reads stdin)",
+    )
+    parser.add_argument(
+        "-k",
+        help="Number of next paths to predict for each event",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--budget",
+        help="Latency budget for each event, in milliseconds (default 1)",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--interval",
+        help="Seconds to wait for new lines when following a recording",
+        type=float,
+        default=0.05,
+    )
+    return parser
+
+
+def follow(filename, interval=0.05):
+    """
+    Yield lines of a file as they are written, like tail -f.
+    """
+    with open(filename, "r") as fd:
+        partial = ""
+        while True:
+            line = fd.readline()
+            if not line:
+                time.sleep(interval)
+                continue
+            partial += line
+            if partial.endswith("\n"):
+                yield partial
+                partial = ""
+
+
+def print_latencies(latencies, budget):
+    """
+    Print the number of events predicted, and latency percentiles.
+    """
+    latencies = numpy.array(latencies) / 1e6
+    if not len(latencies):
+        print("No events were predicted", file=sys.stderr)
+        return
+    p50, p99 = numpy.percentile(latencies, [50, 99])
+    late = int((latencies > budget).sum())
+    print(
+        f"{len(latencies)} events, p50 {p50:.4f}ms, p99 {p99:.4f}ms, "
+        f"max {latencies.max():.4f}ms, {late} over the {budget}ms budget",
+        file=sys.stderr,
+    )
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    model = TransitionModel.load(args.model)
+    lines = follow(args.follow, args.interval) if args.follow else sys.stdin
+    budget = int(args.budget * 1e6)
+
+    # Latency is from reading an event to having its predictions, and an
+    # event over the budget is still written, but marked late (a prefetcher
+    # would likely skip it, since the next open is already happening)
+    latencies = []
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for line in lines:
+            start = time.perf_counter_ns()
+            event = parse_line(line)
+            if not event or event[1] != model.operation:
+                continue
+            timestamp, _, path = event
+            predictions = model.predict(path, args.k)
+            elapsed = time.perf_counter_ns() - start
+            result = {"timestamp": timestamp, "path": path, "predictions": predictions}
+            if elapsed > budget:
+                result["late"] = True
+            latencies.append(elapsed)
+            print(json.dumps(result), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print_latencies(latencies, args.budget)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import numpy
+import scipy.sparse
+
+from container_recorder import normalize_path
+
+# How many of the most probable next paths we save for each path
+MODEL_TOP = 10
+
+# Bump the version if the saved model (or how it's trained) changes
+MODEL_VERSION = 2
+
+
+class TransitionModel:
+    """
+    A Markov model of the next path opened, saved so it can be memory mapped.
+
+    Transitions are a sparse (CSR) matrix of probabilities, with a row for
+    each path we saw opened. We also keep the top next paths for every row,
+    sorted by probability (ties go to the lower state), so a prediction is
+    one dict lookup and one row of a table. Only the pages we read are loaded
+    from disk, so a model for many paths starts fast and stays small.
+
+    States are paths without .so versions (unless remove_so_version is False),
+    and a normalized path like libc.so might not exist. Files are the path we
+    predict for each state (the one opened most), so it can be read ahead.
+    """
+
+    def __init__(
+        self,
+        paths,
+        indptr,
+        indices,
+        probabilities,
+        top_states,
+        top_probabilities,
+        operation="Open",
+        remove_so_version=True,
+        files=None,
+    ):
+        self.paths = paths
+        self.files = list(paths) if files is None else files
+        self.states = {path: idx for idx, path in enumerate(paths)}
+        self.indptr = indptr
+        self.indices = indices
+        self.probabilities = probabilities
+        self.top_states = top_states
+        self.top_probabilities = top_probabilities
+        self.operation = operation
+        self.remove_so_version = remove_so_version
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def top(self):
+        return self.top_states.shape[1]
+
+    @classmethod
+    def from_counts(
+        cls,
+        counts,
+        paths,
+        top=MODEL_TOP,
+        operation="Open",
+        remove_so_version=True,
+        files=None,
+    ):
+        """
+        Make a model from a sparse matrix of transition counts between paths.
+
+        Files are the path to predict for each state (the paths by default).
+        """
+        counts = scipy.sparse.csr_matrix(counts, dtype=numpy.float64)
+        counts.eliminate_zeros()
+        counts.sort_indices()
+        totals = numpy.asarray(counts.sum(axis=1)).ravel()
+        lengths = numpy.diff(counts.indptr)
+        rows = numpy.repeat(numpy.arange(len(lengths)), lengths)
+        probabilities = counts.data / totals[rows]
+
+        # Sort each row by probability (then state), and keep the first top
+        order = numpy.lexsort((counts.indices, -probabilities, rows))
+        rank = numpy.arange(len(order)) - numpy.repeat(counts.indptr[:-1], lengths)
+        keep = rank < top
+        top_states = numpy.full((len(paths), top), -1, dtype=numpy.int32)
+        top_probabilities = numpy.zeros((len(paths), top), dtype=numpy.float32)
+        top_states[rows[keep], rank[keep]] = counts.indices[order][keep]
+        top_probabilities[rows[keep], rank[keep]] = probabilities[order][keep]
+        return cls(
+            list(paths),
+            counts.indptr.astype(numpy.int64),
+            counts.indices.astype(numpy.int32),
+            probabilities.astype(numpy.float32),
+            top_states,
+            top_probabilities,
+            operation,
+            remove_so_version,
+            files,
+        )
+
+    def state(self, path):
+        """
+        Get the state for a path, or None if we never saw it opened.
+        """
+        if self.remove_so_version:
+            path = normalize_path(path)
+        return self.states.get(path)
+
+    def predict(self, path, k=None):
+        """
+        Predict the k most probable next files after path, with probabilities.
+
+        A path we never saw (or never saw anything opened after) has no
+        predictions. If k is more than we saved, we sort the row instead.
+        """
+        k = self.top if k is None else k
+        idx = self.state(path)
+        if idx is None:
+            return []
+        if k <= self.top:
+            states = self.top_states[idx, :k]
+            probabilities = self.top_probabilities[idx, :k]
+            found = states >= 0
+            states, probabilities = states[found], probabilities[found]
+        else:
+            start, end = self.indptr[idx], self.indptr[idx + 1]
+            probabilities = numpy.asarray(self.probabilities[start:end])
+            columns = numpy.asarray(self.indices[start:end])
+            order = numpy.lexsort((columns, -probabilities))[:k]
+            states, probabilities = columns[order], probabilities[order]
+        return [
+            (self.files[state], float(probability))
+            for state, probability in zip(states.tolist(), probabilities.tolist())
+        ]
+
+    def transitions(self):
+        """
+        Get the transition probabilities as a sparse matrix.
+        """
+        return scipy.sparse.csr_matrix(
+            (self.probabilities, self.indices, self.indptr),
+            shape=(len(self.paths), len(self.paths)),
+        )
+
+    def save(self, root):
+        """
+        Save the model to a directory, one .npy per array and the paths.
+        """
+        os.makedirs(root, exist_ok=True)
+        for name in model_arrays():
+            tmp = os.path.join(root, f"{name}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as fd:
+                numpy.save(fd, getattr(self, name))
+            os.replace(tmp, os.path.join(root, f"{name}.npy"))
+
+        # The meta file is written last, so a model is never partly saved
+        meta = {
+            "version": MODEL_VERSION,
+            "operation": self.operation,
+            "remove_so_version": self.remove_so_version,
+            "paths": self.paths,
+            "files": self.files,
+        }
+        tmp = os.path.join(root, f"model.json.{os.getpid()}.tmp")
+        with open(tmp, "w") as fd:
+            fd.write(json.dumps(meta))
+        os.replace(tmp, os.path.join(root, "model.json"))
+
+    @classmethod
+    def load(cls, root, mmap=True):
+        """
+        Load a saved model, memory mapping the arrays unless mmap is False.
+        """
+        with open(os.path.join(root, "model.json"), "r") as fd:
+            meta = json.loads(fd.read())
+        if meta["version"] != MODEL_VERSION:
+            raise ValueError(f"{root} was saved by another version")
+        arrays = [
+            numpy.load(
+                os.path.join(root, f"{name}.npy"), mmap_mode="r" if mmap else None
+            )
+            for name in model_arrays()
+        ]
+        return cls(
+            meta["paths"],
+            *arrays,
+            meta["operation"],
+            meta["remove_so_version"],
+            meta["files"],
+        )
+
+
+def model_arrays():
+    """
+    Names of the arrays of a TransitionModel, in the order of its arguments.
+    """
+    return ["indptr", "indices", "probabilities", "top_states", "top_probabilities"]
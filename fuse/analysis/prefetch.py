@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import heapq
+
+import numpy
+import pandas
+
+# Times in recordings (and ms_in_state) are nanoseconds, and manifests are ms
+NS_PER_MS = 1e6
+
+# Time in state longer than this (ms) is the program doing other work (like
+# hwloc finding the topology) and not reading the file it opened
+MAX_LEAD_MS = 10.0
+
+# Columns of a prefetch manifest, in the order we save them
+MANIFEST_COLUMNS = [
+    "order",
+    "path",
+    "issue_ms",
+    "at_ms",
+    "lead_ms",
+    "releases",
+    "weight",
+]
+
+
+def release_name(basename):
+    """
+    Get the release (recording name without extensions) for a recording.
+
+    Different recordings can be the same release (like one per rank), so
+    we keep recordings apart and only group them by release when asked.
+    """
+    return basename.split(".")[0]
+
+
+def first_opens(df):
+    """
+    Get the first open of each file in each recording (a Traces.to_dataframe).
+
+    Recordings are kept apart by filename, and each has its release. The
+    offset is when the file was first opened, from the first open of the
+    recording, and the cost is the least time in state (until the next open)
+    after any open of it. The program can do other work before the next open,
+    so the least is our best guess of reading the file. Both are ns.
+    """
+    frame = pandas.DataFrame(
+        {
+            "recording": df["filename"].astype(object),
+            "release": df["basename"].astype(object).map(release_name),
+            "path": df["path"].astype(object),
+            "timestamp": df["timestamp"].to_numpy(),
+            "cost": pandas.to_numeric(df["ms_in_state"]).to_numpy(),
+        }
+    )
+    start = frame.groupby("recording", sort=False)["timestamp"].transform("min")
+    frame["offset"] = frame["timestamp"] - start
+    cost = frame.groupby(["recording", "path"], sort=False)["cost"].transform("min")
+    frame["cost"] = cost.fillna(0)
+    frame = frame.drop_duplicates(["recording", "path"], keep="first")
+    columns = ["recording", "release", "path", "offset", "cost"]
+    return frame[columns].reset_index(drop=True)
+
+
+def build_manifest(opens, release=None, min_weight=0.0, max_lead=MAX_LEAD_MS):
+    """
+    Build an ordered prefetch manifest from first opens.
+
+    For a release, the files are the ones its recordings opened, and
+    otherwise they are every file (combined), with the median offset and cost
+    across the recordings.
+    Lead time is the cost (up to max_lead ms), so reading a file ahead has to
+    start that long before it's opened (the issue time) to be ready. Files are
+    in the order they are first opened, since reading the one needed next
+    misses the fewest.
+    Weight is the fraction of releases that open a file, and files with less
+    than min_weight are left out.
+    """
+    counts = opens.groupby("path", sort=False)["release"].nunique()
+    rows = opens if release is None else opens[opens["release"] == release]
+    stats = rows.groupby("path", sort=False)[["offset", "cost"]].median()
+    at, lead = stats["offset"], stats["cost"]
+
+    lead = lead.clip(upper=max_lead * NS_PER_MS)
+    manifest = pandas.DataFrame(
+        {
+            "path": at.index,
+            "issue_ms": (at - lead).clip(lower=0).to_numpy() / NS_PER_MS,
+            "at_ms": at.to_numpy() / NS_PER_MS,
+            "lead_ms": lead.to_numpy() / NS_PER_MS,
+            "releases": counts.reindex(at.index).to_numpy(),
+        }
+    )
+    manifest["weight"] = manifest["releases"] / opens["release"].nunique()
+    manifest = manifest[manifest["weight"] >= min_weight]
+
+    # Ties go to the file more releases share
+    manifest = manifest.sort_values(
+        ["at_ms", "weight"], ascending=[True, False], kind="stable"
+    )
+    manifest.insert(0, "order", numpy.arange(len(manifest)))
+    return manifest[MANIFEST_COLUMNS].reset_index(drop=True)
+
+
+def simulate(manifest, opens, streams=1, max_lead=MAX_LEAD_MS):
+    """
+    Replay the first opens of one recording against a prefetch manifest.
+
+    Opens (from first_opens) should be for one recording.
+
+    Files are read ahead in manifest order by some number of streams, from
+    the start of the recording. A file takes its cost in the recording (up to
+    max_lead ms) to read, or its lead time if the recording never opens it.
+    When the recording opens a file that is already read, we save its cost,
+    and if it is still being read, we save whatever is left after waiting.
+    Saving time makes every later open happen sooner. This assumes reading
+    ahead doesn't slow anything else down, so it's an upper bound.
+    """
+    cost = dict(zip(opens["path"], (opens["cost"] / NS_PER_MS).clip(upper=max_lead)))
+
+    # When each file is done being read ahead
+    ready = {}
+    free = [0.0] * streams
+    for path, lead in zip(manifest["path"], manifest["lead_ms"]):
+        if path in ready:
+            continue
+        ready[path] = heapq.heappop(free) + cost.get(path, lead)
+        heapq.heappush(free, ready[path])
+
+    saved = 0.0
+    hits = partial = missed = 0
+    for path, offset in zip(opens["path"], opens["offset"] / NS_PER_MS):
+        if path not in ready:
+            missed += 1
+            continue
+        at = offset - saved
+        waiting = max(ready[path] - at, 0.0)
+        if waiting >= cost[path]:
+            missed += 1
+            continue
+        saved += cost[path] - waiting
+        if waiting:
+            partial += 1
+        else:
+            hits += 1
+
+    opened = set(cost)
+    startup = (opens["offset"] + opens["cost"]).max() / NS_PER_MS
+    return {
+        "startup_ms": startup,
+        "saved_ms": saved,
+        "estimated_ms": startup - saved,
+        "files": len(opens),
+        "hits": hits,
+        "partial": partial,
+        "missed": missed,
+        "wasted": sum(1 for path in ready if path not in opened),
+    }
@@ -3,10 +3,11 @@
 import argparse
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas
 import matplotlib.pylab as plt
-from scipy.stats import poisson
-from numpy.random import choice
+import scipy.sparse
 import numpy
 
 from matplotlib.backends.backend_pdf import PdfPages
@@ -15,7 +16,11 @@ from itertools import cycle
 
 here = os.path.dirname(__file__)
 sys.path.insert(0, here)
-from container_recorder import Traces
+from container_recorder import Traces, concatenate_arrays
+from prediction import TransitionModel
+
+# Counts and samples for fold worker processes, set once when the pool starts
+fold_state = None
 
 
 def get_parser():
@@ -34,6 +39,61 @@ def get_parser():
         default=os.path.join(here, "img"),
     )
     parser.add_argument("--name", help="Application name", default="LAMMPS")
+    parser.add_argument(
+        "--cache",
+        help="Cache parsed recordings on disk (next to each recording)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache parsed recordings in (implies --cache)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to parse recordings and run folds with",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--folds",
+        help="Number of folds for cross validation (default is leave one out)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed for sampling predictions, so results can be reproduced",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--fold-times",
+        help="Save the time each fold took (csv) to this file",
+    )
+    parser.add_argument(
+        "--save-model",
+        help="Save the Markov model of all recordings to this directory (for predict-next.py)",
+    )
+    parser.add_argument(
+        "--raw-paths",
+        help="Save the model with paths as opened (keep .so versions)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--order",
+        help="Longest context (number of previous paths) for the n-gram model",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--top",
+        help="Also score the top K most probable next paths (default 3)",
+        type=int,
+        default=3,
+    )
     return parser
 
 
@@ -42,43 +102,122 @@ def main():
 
     # Extra events here should be one or more result event files to parse
     args, events = p.parse_known_args()
-    simcalc = Traces(events)
+    simcalc = Traces(
+        events, cache=args.cache, cache_dir=args.cache_dir, workers=args.jobs
+    )
     df = simcalc.to_dataframe()
 
+    # Paths are interned ids, and states are a dense index of the ids we see
+    samples = simcalc.as_ids()
+    names = list(samples)
+    states, sequences = encode_samples(list(samples.values()))
+    paths = simcalc.paths.lookup(states)
+    nstates = len(states)
+
+    # We count transitions (and times in state) for each sample once, and the
+    # model for a fold is the total minus the counts of the held out samples
+    frequencies = count_frequencies(sequences, nstates)
+    transitions = [count_transitions([sequence], nstates) for sequence in sequences]
+    frame = transition_frame(df, paths)
+    times = count_times(frame, names, nstates)
+    trace_rows = frame.groupby("basename", sort=False).indices
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    set_fold_state(
+        {
+            "sequences": sequences,
+            "nstates": nstates,
+            "top": args.top,
+            "frequencies": frequencies,
+            "total_frequencies": frequencies.sum(axis=0),
+            "transitions": transitions,
+            "total_transitions": sum_counts(transitions),
+            "sums": [sums for sums, _ in times],
+            "counts": [counts for _, counts in times],
+            "total_sums": sum_counts([sums for sums, _ in times]),
+            "total_counts": sum_counts([counts for _, counts in times]),
+            "trie": PathTrie(sequences, nstates, args.order),
+            "rows": [frame.iloc[trace_rows.get(name, empty)] for name in names],
+        }
+    )
+
+    # The model we save is trained on every recording
+    if args.save_model:
+        model = build_saved_model(simcalc, args.raw_paths)
+        model.save(args.save_model)
+        print(f"Saved model of {len(model)} paths to {args.save_model}")
+
+    # Every fold (of every experiment) gets its own generator from the seed,
+    # so results are the same no matter how many processes run them
+    seed = numpy.random.SeedSequence(args.seed)
+    print(f"Seed: {seed.entropy}")
+    (
+        shuffle_seed,
+        markov_seed,
+        ngram_seed,
+        timing_seed,
+        residual_seed,
+        frequency_seed,
+    ) = seed.spawn(6)
+    folds = list(
+        iter_folds(len(sequences), args.folds, numpy.random.default_rng(shuffle_seed))
+    )
+    validation = f"{len(folds)}-fold" if args.folds else "Leave one out"
+    fold_times = []
+
     # Test 1: Simple Markov Model.
     # Let's generate a transition matrix based on unique paths
     # Let's do leave one out cross validation to use each as a test sample
     # And then just predict each path based on the previous and calculate
     # a total accuracy (correct / total) for the entire set.
-    results = {"correct": 0, "wrong": 0}
-    for train, test, _ in simcalc.iter_loo():
-        for key, value in build_and_test_markov(train, test).items():
-            if key.startswith("transition"):
-                continue
-            results[key] += value
-
+    # We also score the probabilities directly (expected, argmax and top k)
+    outputs, seconds = run_folds(markov_fold, folds, markov_seed, args.jobs)
+    fold_times.append(("markov", seconds))
     print("Markov Model Results")
-    print_results(results)
+    print_results(add_results([results for results, _ in outputs]), validation)
+    print_scores(add_results([scores for _, scores in outputs]))
+    print_fold_times(seconds)
+
+    # Test 1b: N-gram model, predicting from up to order previous paths, and
+    # backing off to fewer when the longer context wasn't seen in training
+    outputs, seconds = run_folds(ngram_fold, folds, ngram_seed, args.jobs)
+    fold_times.append(("ngram", seconds))
+    contexts = len(fold_state["trie"])
+    print(f"N-gram Model Results (order {args.order}, {contexts} contexts)")
+    print_results(add_results([results for results, _ in outputs]), validation)
+    print_scores(add_results([scores for _, scores in outputs]))
+    print_fold_times(seconds)
 
     # Let's compare to overall frequency - so ONE row that we do counts, and then
     # run the same procedure for. We could call this a 0-gram model :)
-    frequency_results = build_and_test_frequency_model(simcalc.samples)
+    outputs, seconds = run_folds(frequency_fold, folds, frequency_seed, args.jobs)
+    fold_times.append(("frequency", seconds))
     print("Frequency Results")
-    print_results(frequency_results)
+    print_results(add_results([results for results, _ in outputs]), validation)
+    print_scores(add_results([scores for _, scores in outputs]))
+    print_fold_times(seconds)
 
     # Test 2: Hidden Markov Models with Conditional Transition Times
     # We start with our same matrix of transition probabilities, but we also construct
     # a matrix of mean timeseries (Poisson distributed)
     # The results are residuals, so we can look at the error
-    residuals = {}
-    for train, test, left_out in simcalc.iter_loo():
-        # This takes the time in the state into account
-        for path, new_residuals in build_and_test_markov_with_times(
-            df, train, test, left_out
-        ).items():
-            if path not in residuals:
-                residuals[path] = []
-            residuals[path] += new_residuals
+    timed, seconds = run_folds(timing_fold, folds, timing_seed, args.jobs)
+    fold_times.append(("timing", seconds))
+    print("Timing Folds")
+    print_fold_times(seconds)
+
+    # Predicted times for every fold are drawn at once
+    residuals = compute_residuals(
+        *[numpy.concatenate(columns) for columns in zip(*timed)],
+        paths,
+        numpy.random.default_rng(residual_seed),
+    )
+
+    if args.fold_times:
+        save_fold_times(args.fold_times, fold_times, folds, names)
+
+    # Summarize the time in state for the most common transitions
+    print("Time in State")
+    print_timeseries(build_timeseries_matrix(frame, nstates), paths)
 
     plt.rcParams["figure.figsize"] = [7.00, 3.50]
     plt.rcParams["figure.autolayout"] = True
@@ -97,13 +236,194 @@ def main():
     plt.clf()
 
 
-def print_results(results):
+def run_folds(function, folds, seed, workers=None):
+    """
+    Run function(held_out, rng) for each fold, in a process pool with workers.
+
+    Each fold gets its own generator, spawned from seed (a SeedSequence), so
+    results don't depend on the number of workers or the order folds finish.
+    Returns the result and seconds for each fold, in the order of folds.
+    """
+    tasks = [
+        (function, held_out, fold_seed)
+        for held_out, fold_seed in zip(folds, seed.spawn(len(folds)))
+    ]
+    if not workers or workers == 1 or len(folds) == 1:
+        outputs = list(map(run_fold, tasks))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=set_fold_state, initargs=(fold_state,)
+        ) as pool:
+            outputs = list(pool.map(run_fold, tasks))
+    return [result for result, _ in outputs], [seconds for _, seconds in outputs]
+
+
+def run_fold(task):
+    """
+    Run one fold with its own generator, and time it.
+    """
+    function, held_out, seed = task
+    start = time.perf_counter()
+    result = function(held_out, numpy.random.default_rng(seed))
+    return result, time.perf_counter() - start
+
+
+def set_fold_state(state):
+    """
+    Give a worker the counts and samples, so folds only need to send indices.
+    """
+    global fold_state
+    fold_state = state
+
+
+def markov_fold(held_out, rng):
+    """
+    Test the held out samples against the Markov model of the rest.
+    """
+    state = fold_state
+    tm = normalize_rows(
+        subtract_counts(state["total_transitions"], state["transitions"], held_out)
+    )
+    results = []
+    scores = []
+    for left_out in held_out:
+        test = state["sequences"][left_out]
+        result = test_markov(tm, test, rng)
+        results.append({key: result[key] for key in ["correct", "wrong"]})
+        scores.append(evaluate_markov(tm, test, state["top"]))
+    return add_results(results), add_results(scores)
+
+
+def frequency_fold(held_out, rng):
+    """
+    Test the held out samples against the path frequencies of the rest.
+    """
+    state = fold_state
+    frequencies = state["total_frequencies"] - state["frequencies"][held_out].sum(
+        axis=0
+    )
+    results = []
+    scores = []
+    for left_out in held_out:
+        result, score = build_and_test_frequency_model(
+            frequencies, state["sequences"][left_out], rng, state["top"]
+        )
+        results.append(result)
+        scores.append(score)
+    return add_results(results), add_results(scores)
+
+
+def ngram_fold(held_out, rng):
+    """
+    Test the held out samples against the n-gram model of the rest.
+    """
+    trie = fold_state["trie"]
+    matrix, totals = trie.fold_matrix(held_out)
+    results = []
+    scores = []
+    for left_out in held_out:
+        result, score = test_ngram(
+            trie, matrix, totals, left_out, rng, fold_state["top"]
+        )
+        results.append(result)
+        scores.append(score)
+    return add_results(results), add_results(scores)
+
+
+def timing_fold(held_out, rng):
+    """
+    Get the correct transitions (with mean and actual times) for held out samples.
+    """
+    state = fold_state
+    tm = normalize_rows(
+        subtract_counts(state["total_transitions"], state["transitions"], held_out)
+    )
+    ts = timeseries_mean(
+        subtract_counts(state["total_sums"], state["sums"], held_out),
+        subtract_counts(state["total_counts"], state["counts"], held_out),
+    )
+
+    # This takes the time in the state into account
+    timed = [
+        build_and_test_markov_with_times(
+            tm,
+            ts,
+            state["sequences"][left_out],
+            state["rows"][left_out],
+            state["nstates"],
+            rng,
+        )
+        for left_out in held_out
+    ]
+    return [numpy.concatenate(columns) for columns in zip(*timed)]
+
+
+def add_results(results):
+    """
+    Add up a list of result (or score) dicts, key by key.
+    """
+    total = {}
+    for result in results:
+        for key, value in result.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def print_fold_times(seconds):
+    seconds = numpy.array(seconds)
+    print(
+        f"  {len(seconds)} folds took {seconds.sum():.3f}s "
+        f"(mean {seconds.mean():.4f}s, max {seconds.max():.4f}s)"
+    )
+
+
+def save_fold_times(filename, fold_times, folds, names):
+    """
+    Save the seconds for each fold of each experiment to a csv file.
+    """
+    rows = []
+    for experiment, seconds in fold_times:
+        for idx, (held_out, fold_seconds) in enumerate(zip(folds, seconds)):
+            held_out = " ".join(names[left_out] for left_out in held_out)
+            rows.append([experiment, idx, held_out, fold_seconds])
+    pandas.DataFrame(
+        rows, columns=["experiment", "fold", "held_out", "seconds"]
+    ).to_csv(filename, index=False)
+
+
+def print_results(results, validation="Leave one out"):
     accuracy = results["correct"] / (results["correct"] + results["wrong"])
-    print(f"  Leave one out correct: {results['correct']}")
-    print(f"    Leave one out wrong: {results['wrong']}")
+    print(f"{validation + ' correct':>23}: {results['correct']}")
+    print(f"{validation + ' wrong':>23}: {results['wrong']}")
     print(f"          correct/total: {accuracy}")
 
 
+def print_scores(scores):
+    total = scores["predictions"]
+    print(f"       expected correct/total: {scores['expected'] / total}")
+    print(f"         argmax correct/total: {scores['top-1'] / total}")
+    for key in scores:
+        if key.startswith("top-") and key != "top-1":
+            print(f"  top {key[4:]:>2} paths correct/total: {scores[key] / total}")
+
+
+def print_timeseries(stats, paths, count=10):
+    """
+    Print time in state statistics for the most common transitions.
+    """
+    counts = stats["count"].tocoo()
+    rows = pandas.DataFrame(
+        {
+            "from": [os.path.basename(paths[idx]) for idx in counts.row],
+            "to": [os.path.basename(paths[idx]) for idx in counts.col],
+        }
+    )
+    for name, matrix in stats.items():
+        rows[name] = numpy.asarray(matrix[counts.row, counts.col]).ravel()
+    rows = rows.sort_values("count", ascending=False, kind="stable").head(count)
+    print(rows.to_string(index=False))
+
+
 def save_histogram_pdf(save_path):
     """
     Save current plotting context to pdf with PdfPages.
@@ -118,196 +438,596 @@ def save_histogram_pdf(save_path):
             fig.savefig(p, format="pdf")
 
 
-def build_and_test_frequency_model(samples):
+def build_and_test_frequency_model(frequencies, test, rng=None, top=3):
     """
     I don't know if there is a name for this, but a "base case" to test
     against the Markov model would be to use the frequencies across
     all datasets -> paths for the path instead one one scoped to the
     previous path.
+
+    Frequencies are the path (state) counts of the training samples. Every
+    state but the first is predicted from them, so we sample all at once,
+    and the expected and top k scores are closed form: the model is one row,
+    so the rank of every state is the same for every step.
     """
-    unique_paths = list(set([x for xs in samples for x in xs]))
-    tm = pandas.DataFrame(0, index=unique_paths, columns=["frequency"])
-    for paths in samples:
-        for path in paths:
-            tm.loc[path, "frequency"] += 1
-
-    # Make sure each row sums to 1
-    tm_norm = tm.div(tm.sum(axis=0), axis=1)
-    results = {"correct": 0, "wrong": 0}
-
-    # This is the list of paths we can choose from for the next
-    path_selection = tm_norm.index.tolist()
-    probabilities = tm_norm["frequency"].values.tolist()
-    for test in samples:
-        for i, path in enumerate(test):
-            if i + 1 >= len(test):
-                break
-            # Make a choice and see if it's right.
-            draw = choice(path_selection, 1, p=probabilities)
-            if draw[0] == path:
-                results["correct"] += 1
-            else:
-                results["wrong"] += 1
-    return results
-
-
-def test_markov(tm_norm, test):
+    rng = rng or numpy.random.default_rng()
+    following = test[1:]
+    probability = frequencies / max(frequencies.sum(), 1)
+
+    # Make a choice for every state at once and see which are right.
+    cumulative = numpy.cumsum(probability)
+    draws = numpy.searchsorted(
+        cumulative, rng.random(len(following)) * cumulative[-1], side="right"
+    )
+    correct = int((draws == following).sum())
+    results = {"correct": correct, "wrong": len(following) - correct}
+
+    # Rank states by probability, where ties go to the lower state
+    rank = numpy.empty(len(probability), dtype=numpy.int64)
+    rank[numpy.lexsort((numpy.arange(len(probability)), -probability))] = numpy.arange(
+        len(probability)
+    )
+    seen = probability[following] > 0
+    scores = {
+        "predictions": len(following),
+        "expected": float(probability[following].sum()),
+    }
+    for k in sorted({1, top}):
+        scores[f"top-{k}"] = int((seen & (rank[following] < k)).sum())
+    return results, scores
+
+
+def test_markov(tm_norm, test, rng=None):
     """
     Given a test vector, test against a normalized transition matrix.
+
+    The test vector is states, and tm_norm is a sparse matrix (rows are the
+    previous state). We draw the next state from the transitions we saw out
+    of a state, and if we never saw any, there is no prediction (it's wrong).
     """
+    previous = test[:-1]
+    following = test[1:]
+
+    # Make a choice for every state at once and see which are right.
+    draws = sample_markov(tm_norm, previous, rng)
+    correct = draws == following
+    incorrect = ~correct & (draws >= 0)
+
     # Keep track of correct, wrong, and the transitions
-    results = {
-        "correct": 0,
-        "wrong": 0,
-        "transitions-correct": [],
-        "transitions-incorrect": [],
+    return {
+        "correct": int(correct.sum()),
+        "wrong": int(len(correct) - correct.sum()),
+        "transitions-correct": numpy.column_stack(
+            [previous[correct], draws[correct]]
+        ).tolist(),
+        "transitions-incorrect": numpy.column_stack(
+            [previous[incorrect], draws[incorrect]]
+        ).tolist(),
     }
 
-    # Let's use leave one out cross validation to test our model
-    for i, path in enumerate(test):
-        if i + 1 >= len(test):
-            break
-        # This is the path we are trying to predict
-        next_path = test[i + 1]
 
-        # This is the list of paths we can choose from for the next
-        path_selection = tm_norm.loc[path].index.tolist()
+def sample_markov(tm_norm, previous, rng=None):
+    """
+    Draw a next state for each previous state, all at once.
+
+    This is inverse CDF sampling: the cumulative probabilities of each row
+    (plus the row number) increase across the whole matrix, so one uniform
+    draw per state and one searchsorted finds every next state. States
+    with no transitions get -1.
+    """
+    rng = rng or numpy.random.default_rng()
+    indptr, indices = tm_norm.indptr, tm_norm.indices
+    lengths = numpy.diff(indptr)
+    rows = numpy.repeat(numpy.arange(len(lengths)), lengths)
+
+    # Cumulative probability within each row, where the last is exactly 1
+    cumulative = numpy.cumsum(tm_norm.data)
+    before = numpy.concatenate([[0.0], cumulative])[indptr[:-1]]
+    within = cumulative - before[rows]
+    keys = rows + within / within[indptr[1:][rows] - 1]
+
+    draws = numpy.full(len(previous), -1, dtype=numpy.int64)
+    uniform = rng.random(len(previous))
+    found = lengths[previous] > 0
+    positions = numpy.searchsorted(keys, previous[found] + uniform[found], side="right")
+    draws[found] = indices[positions]
+    return draws
+
+
+def evaluate_markov(tm_norm, test, top=3):
+    """
+    Score the predictions for a test vector without sampling.
+
+    Expected is the sum of the probability of each true next state (how
+    many we'd get right on average by sampling), and top-k is how many
+    true next states are among the k most probable (top-1 is the argmax).
+    Ties go to the lower state. Everything is computed for the whole test
+    vector at once.
+    """
+    return evaluate_predictions(tm_norm, test[:-1], test[1:], top)
+
+
+def evaluate_predictions(tm_norm, previous, following, top=3):
+    """
+    Score predictions of following from rows (previous) of a sparse matrix.
+    """
+    probability = sparse_entries(tm_norm, previous, following)
+
+    # Every entry in each previous state's row, for every step
+    indptr = tm_norm.indptr
+    lengths = indptr[previous + 1] - indptr[previous]
+    steps = numpy.repeat(numpy.arange(len(previous)), lengths)
+    offsets = numpy.arange(lengths.sum()) - numpy.repeat(
+        numpy.cumsum(lengths) - lengths, lengths
+    )
+    positions = indptr[previous][steps] + offsets
+    values = tm_norm.data[positions]
+    columns = tm_norm.indices[positions]
+
+    # The rank of the true next state is how many entries beat it
+    beats = (values > probability[steps]) | (
+        (values == probability[steps]) & (columns < following[steps])
+    )
+    rank = numpy.bincount(steps, weights=beats, minlength=len(previous))
+    seen = probability > 0
+    scores = {"predictions": len(previous), "expected": float(probability.sum())}
+    for k in sorted({1, top}):
+        scores[f"top-{k}"] = int((seen & (rank < k)).sum())
+    return scores
+
+
+def test_ngram(trie, matrix, totals, idx, rng=None, top=3):
+    """
+    Test a sample against an n-gram model (a PathTrie and a fold's matrix).
 
-        # These are the probabilities of each
-        probabilities = tm_norm.loc[path].values.tolist()
+    Every state but the first is predicted from the longest context that
+    has counts in the fold, and we return correct and wrong (sampled) and
+    the expected and top k scores.
+    """
+    contexts, following = trie.backoff(idx, totals)
+    draws = sample_markov(matrix, contexts, rng)
+    correct = int((draws == following).sum())
+    results = {"correct": correct, "wrong": len(following) - correct}
+    return results, evaluate_predictions(matrix, contexts, following, top)
 
-        # Make a choice and see if it's right.
-        draw = choice(path_selection, 1, p=probabilities)
-        if draw[0] == next_path:
-            results["correct"] += 1
-            results["transitions-correct"].append([path, draw[0]])
-        else:
-            results["wrong"] += 1
-            results["transitions-incorrect"].append([path, draw[0]])
-    return results
 
+class PathTrie:
+    """
+    A count trie for n-gram models of paths (states), up to some order.
 
-def build_and_test_markov(train, test):
+    A node is a context, the previous states read backwards (most recent
+    first), so the children of a node are its context with one more state
+    further back. Nodes are numbered level by level and sorted by (parent,
+    state), so the trie is just arrays (parent and state for each node) and
+    never needs a dense matrix per order. Counts are kept per (node, next
+    state) entry, for each sample, so a fold is the total minus its samples.
+    The root (node 0) is the empty context (how often we see each state).
+    """
+
+    def __init__(self, samples, nstates, order=3):
+        self.nstates = nstates
+        self.order = order
+        lengths = numpy.array([len(sample) for sample in samples], dtype=numpy.int64)
+        states = concatenate_arrays(samples, numpy.int64)
+        starts = numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        position = numpy.arange(len(states)) - starts
+        trace = numpy.repeat(numpy.arange(len(samples)), lengths)
+
+        # The context node at each depth for each position (-1 if too short)
+        self.contexts = numpy.full((order + 1, len(states)), -1, dtype=numpy.int64)
+        self.contexts[0] = 0
+        parents = [numpy.array([-1])]
+        symbols = [numpy.array([-1])]
+        count = 1
+        for depth in range(1, order + 1):
+            valid = numpy.flatnonzero(position >= depth)
+            codes = self.contexts[depth - 1][valid] * nstates + states[valid - depth]
+            codes, inverse = numpy.unique(codes, return_inverse=True)
+            self.contexts[depth][valid] = count + inverse
+            parents.append(codes // nstates)
+            symbols.append(codes % nstates)
+            count += len(codes)
+        self.parents = numpy.concatenate(parents)
+        self.symbols = numpy.concatenate(symbols)
+
+        # One entry per (context, next state), and its count for each sample
+        depth, index = numpy.nonzero(self.contexts >= 0)
+        codes = self.contexts[depth, index] * nstates + states[index]
+        codes, entries = numpy.unique(codes, return_inverse=True)
+        self.entry_node = codes // nstates
+        self.entry_state = codes % nstates
+        pairs, counts = numpy.unique(
+            trace[index] * len(codes) + entries, return_counts=True
+        )
+        bounds = numpy.searchsorted(pairs // len(codes), numpy.arange(len(samples) + 1))
+        self.sample_counts = [
+            (pairs[start:end] % len(codes), counts[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+        self.total = numpy.bincount(entries, minlength=len(codes))
+        self.starts = numpy.cumsum(lengths) - lengths
+        self.lengths = lengths
+        self.states = states
+
+    def __len__(self):
+        return len(self.parents)
+
+    def fold_counts(self, held_out):
+        """
+        Get the entry counts without the held out samples.
+        """
+        counts = self.total.copy()
+        for idx in held_out:
+            entries, sample_counts = self.sample_counts[idx]
+            counts[entries] -= sample_counts
+        return counts
+
+    def fold_matrix(self, held_out):
+        """
+        Get the next state probabilities for each context for a fold.
+
+        Returns a sparse (contexts x states) matrix where each row with counts
+        sums to 1, and the total count for each context.
+        """
+        counts = self.fold_counts(held_out)
+        shape = (len(self), self.nstates)
+        matrix = scipy.sparse.csr_matrix(
+            (counts, (self.entry_node, self.entry_state)), shape=shape
+        )
+        matrix.eliminate_zeros()
+        totals = numpy.bincount(self.entry_node, weights=counts, minlength=len(self))
+        return normalize_rows(matrix), totals
+
+    def backoff(self, idx, totals):
+        """
+        Get the context to predict each state (but the first) of a sample.
+
+        This is the longest context (up to the order) that has counts, and
+        we back off to shorter ones (down to the empty context). Returns the
+        contexts and the states they predict.
+        """
+        start, length = self.starts[idx], self.lengths[idx]
+        contexts = self.contexts[:, start + 1 : start + length]
+        usable = contexts >= 0
+        usable[usable] = totals[contexts[usable]] > 0
+        deepest = self.order - numpy.argmax(usable[::-1], axis=0)
+        chosen = contexts[deepest, numpy.arange(contexts.shape[1])]
+        return chosen, self.states[start + 1 : start + length]
+
+
+def build_and_test_markov(train, test, nstates, rng=None):
     """
     Use leave one out strategy to get number of correct and incorrect
     predictions.
     """
-    tm = build_transition_matrix(train)
-    return test_markov(tm, test)
+    tm = build_transition_matrix(train, nstates)
+    return test_markov(tm, test, rng)
 
 
-def build_and_test_markov_with_times(df, train, test, left_out):
+def build_and_test_markov_with_times(tm, ts, test, rows, nstates, rng=None):
     """
     A markov model that also accounts for the timestamps, with
     conditional transition times.
-    """
-    tm = build_transition_matrix(train)
-    ts = build_timeseries_matrix(df, train)
 
+    The transition (tm) and mean time (ts) matrices are for the fold
+    that left out the test, and rows are the test's transition_frame.
+    Returns the previous state, mean time and actual time for each
+    correct transition, and compute_residuals makes the predictions.
+    """
     # Now we know what we transitioned to (some state, a path)
     # and we want to know the entry from the timeseries matrix, the
     # average time to go from A to T. We can use Poisson
     # (captured by mean) for the model to sample from.
-    results = test_markov(tm, test)
-
-    # Create a data frame of just left out values
-    test_df = df[df.basename == left_out]
+    results = test_markov(tm, test, rng)
+    correct = numpy.array(results["transitions-correct"], dtype=numpy.int64)
+    correct = correct.reshape(-1, 2)
 
     # To calculate residuals, we are only going to consider the correct
     # transitions. I don't know how to handle transitions to the self
     # (it isn't really a change of state) so I'm going to skip.
-    residuals = {}
-    for result in results["transitions-correct"]:
-        from_state, to_state = result
-        # if the states are the same path, there is no change of state
-        if from_state == to_state:
-            continue
-        mean_transition = ts.loc[from_state, to_state]
-        dist = poisson(mean_transition)
-        # Generate a random number from distribution to predict time
-        predicted_time = dist.rvs(size=1)[0]
-        subset = test_df[test_df.normalized_path == to_state]
-        subset = subset[subset.previous_path == from_state]
-        actual_time = subset.ms_in_state.values[0]
-
-        # End of series
-        if actual_time is not None:
-            # Not sure if this is OK, but do the difference over the actual
-            # The idea is to try and normalize the residual
-            percent_diff = abs(predicted_time - actual_time) / actual_time
-            if from_state not in residuals:
-                residuals[from_state] = []
-            residuals[from_state].append(percent_diff)
-    return residuals
-
-
-def build_timeseries_matrix(df, train):
+    correct = correct[correct[:, 0] != correct[:, 1]]
+    means = sparse_entries(ts, correct[:, 0], correct[:, 1])
+
+    # The actual time is from the first time the test made the transition
+    codes = rows.previous.to_numpy() * nstates + rows.next.to_numpy()
+    codes, first = numpy.unique(codes, return_index=True)
+    first_times = rows.ms_in_state.to_numpy()[first]
+    wanted = correct[:, 0] * nstates + correct[:, 1]
+    index = numpy.searchsorted(codes, wanted)
+    found = index < len(codes)
+    found[found] = codes[index[found]] == wanted[found]
+    actual = numpy.full(len(wanted), numpy.nan)
+    actual[found] = first_times[index[found]]
+
+    # End of series (no time in state) has no residual
+    keep = ~numpy.isnan(actual)
+    return correct[keep, 0], means[keep], actual[keep]
+
+
+def compute_residuals(states, means, actual, paths, rng=None):
+    """
+    Predict times for transitions and get the residuals for each path.
+
+    All of the predicted times are drawn from Poisson (with the mean time
+    for the transition) in one call. The residual is grouped by the path
+    we came from, in the order they were found.
+    """
+    rng = rng or numpy.random.default_rng()
+
+    # Generate a random number from distribution to predict time
+    predicted = rng.poisson(means)
+
+    # Not sure if this is OK, but do the difference over the actual
+    # The idea is to try and normalize the residual. A time of 0 can't be
+    # normalized, so we skip it.
+    nonzero = actual != 0
+    states, predicted, actual = states[nonzero], predicted[nonzero], actual[nonzero]
+    percent_diff = numpy.abs(predicted - actual) / actual
+
+    uniques, first = numpy.unique(states, return_index=True)
+    order = numpy.argsort(states, kind="stable")
+    bounds = numpy.flatnonzero(numpy.diff(states[order])) + 1
+    groups = numpy.split(percent_diff[order], bounds)
+    return {
+        paths[uniques[idx]]: groups[idx].tolist()
+        for idx in numpy.argsort(first, kind="stable")
+    }
+
+
+def build_timeseries_matrix(frame, nstates, quantiles=(0.5, 0.9)):
     """
     The timeseries matrix calculates the mean time in a specific state,
     meaning if we move from path1 to path2 (the state being in path1)
     we record a time for all these ranges, and then put the mean in a matrix
+
+    All transitions are aggregated in one groupby on (previous, next) state,
+    and we return sparse matrices aligned with the transition matrix for
+    the count, mean, variance and quantiles (e.g., q50) of the times.
+    """
+    timed = frame.dropna(subset=["ms_in_state"])
+    grouped = timed.groupby(["previous", "next"], sort=True).ms_in_state
+    stats = grouped.agg(["count", "mean", "var"])
+    stats["var"] = stats["var"].fillna(0)
+    for quantile in quantiles:
+        stats[f"q{round(quantile * 100)}"] = grouped.quantile(quantile)
+
+    # I visualized this - most looks Poisson
+    previous = stats.index.get_level_values("previous").to_numpy()
+    following = stats.index.get_level_values("next").to_numpy()
+    return {
+        name: scipy.sparse.csr_matrix(
+            (stats[name].to_numpy(), (previous, following)), shape=(nstates, nstates)
+        )
+        for name in stats.columns
+    }
+
+
+def timeseries_mean(sums, counts):
+    """
+    Get the mean time in state from sparse sums and counts (e.g., for a fold).
+
+    This is the same as the mean of build_timeseries_matrix for the samples
+    that were counted. Transitions we haven't timed are 0.
+    """
+    means = counts.astype(float)
+    means.eliminate_zeros()
+    rows = numpy.repeat(numpy.arange(means.shape[0]), numpy.diff(means.indptr))
+    means.data = sparse_entries(sums, rows, means.indices) / means.data
+    return means
+
+
+def build_transition_matrix(train, nstates):
+    """
+    Given states for some training data, build a transition matrix
+
+    This is a sparse (CSR) matrix, rows are the previous state and
+    columns the next, and each row that has transitions sums to 1.
+    """
+    return normalize_rows(count_transitions(train, nstates))
+
+
+def count_frequencies(samples, nstates):
+    """
+    Count the states in each sample, one row per sample, with one bincount.
+    """
+    lengths = [len(states) for states in samples]
+    rows = numpy.repeat(numpy.arange(len(samples)), lengths)
+    states = concatenate_arrays(samples, numpy.int64)
+    counts = numpy.bincount(rows * nstates + states, minlength=len(samples) * nstates)
+    return counts.reshape(len(samples), nstates)
+
+
+def count_transitions(samples, nstates):
+    """
+    Count transitions between states into a sparse (CSR) matrix.
+
+    Each (previous, next) pair is encoded as one integer, so counting is
+    one numpy.unique over all of the samples instead of a cell at a time.
+    """
+    previous = concatenate_arrays([states[:-1] for states in samples], numpy.int64)
+    following = concatenate_arrays([states[1:] for states in samples], numpy.int64)
+    pairs, counts = numpy.unique(previous * nstates + following, return_counts=True)
+    return scipy.sparse.csr_matrix(
+        (counts, (pairs // nstates, pairs % nstates)), shape=(nstates, nstates)
+    )
+
+
+def normalize_rows(counts):
+    """
+    Make each row of a sparse matrix sum to 1 (rows of all zeros stay zero).
+    """
+    totals = numpy.asarray(counts.sum(axis=1), dtype=float).ravel()
+    scale = numpy.divide(1.0, totals, out=numpy.zeros_like(totals), where=totals > 0)
+    return scipy.sparse.csr_matrix(scipy.sparse.diags(scale) @ counts)
+
+
+def sparse_entries(matrix, rows, columns):
+    """
+    Get the entries of a sparse (CSR) matrix at pairs of rows and columns.
+
+    Entries are found in the CSR arrays with one searchsorted, so this is
+    an array for any number of pairs (scipy gives back a 1x0 matrix for
+    none). Entries that aren't stored are 0.
+    """
+    if not matrix.has_sorted_indices:
+        matrix = matrix.sorted_indices()
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    columns = numpy.asarray(columns, dtype=numpy.int64)
+    width = matrix.shape[1]
+    stored = numpy.repeat(numpy.arange(matrix.shape[0]), numpy.diff(matrix.indptr))
+    keys = stored * width + matrix.indices
+    wanted = rows * width + columns
+    index = numpy.searchsorted(keys, wanted)
+    found = index < len(keys)
+    found[found] = keys[index[found]] == wanted[found]
+    values = numpy.zeros(len(wanted))
+    values[found] = matrix.data[index[found]]
+    return values
+
+
+def count_times(frame, names, nstates):
+    """
+    Sum (and count) the times in state for each trace, as sparse matrices.
+
+    This is one groupby on (trace, previous, next) state. Transitions
+    without a time (the end of a recording) are not counted.
+    """
+    timed = frame.dropna(subset=["ms_in_state"])
+    grouped = timed.groupby(["basename", "previous", "next"], sort=True)
+    stats = grouped.ms_in_state.agg(["sum", "count"]).reset_index()
+    traces = stats.groupby("basename", sort=False).indices
+    empty = numpy.zeros(0, dtype=numpy.int64)
+
+    times = []
+    shape = (nstates, nstates)
+    for name in names:
+        rows = stats.iloc[traces.get(name, empty)]
+        index = (rows.previous.to_numpy(), rows.next.to_numpy())
+        sums = scipy.sparse.csr_matrix((rows["sum"].to_numpy(), index), shape)
+        counts = scipy.sparse.csr_matrix((rows["count"].to_numpy(), index), shape)
+        times.append((clean_counts(sums), clean_counts(counts)))
+    return times
+
+
+def transition_frame(df, paths):
+    """
+    Get the transitions in a data frame of events as states.
+
+    Each event (but the first of a recording) is a transition from the
+    previous path to its path, and the time in state is for the event.
+    """
+    state_of = {path: idx for idx, path in enumerate(paths)}
+    rows = df[df.previous_path.notna()]
+    return pandas.DataFrame(
+        {
+            "basename": rows.basename.to_numpy(),
+            "previous": rows.previous_path.map(state_of).to_numpy(numpy.int64),
+            "next": rows.normalized_path.map(state_of).to_numpy(numpy.int64),
+            "ms_in_state": pandas.to_numeric(rows.ms_in_state).to_numpy(float),
+        }
+    )
+
+
+def iter_folds(count, folds=None, rng=None):
+    """
+    Yield the indices of the held out samples for each fold.
+
+    Without folds this is leave one out (in order). With k folds, samples
+    are shuffled and dealt into k folds of about the same size.
+    """
+    if not folds:
+        for idx in range(count):
+            yield [idx]
+        return
+    order = (rng or numpy.random.default_rng()).permutation(count)
+    for fold in numpy.array_split(order, min(folds, count)):
+        yield sorted(fold.tolist())
+
+
+def sum_counts(counts):
+    """
+    Add up a list of sparse count matrices.
+    """
+    total = counts[0].copy()
+    for matrix in counts[1:]:
+        total += matrix
+    return clean_counts(total)
+
+
+def subtract_counts(total, counts, held_out):
+    """
+    Get the counts for a fold, the total minus the held out samples.
+
+    Counts are integers (or sums of integer times), so this is exactly
+    the same matrix as counting the rest of the samples again.
+    """
+    fold = total.copy()
+    for idx in held_out:
+        fold -= counts[idx]
+    return clean_counts(fold)
+
+
+def clean_counts(counts):
+    """
+    Drop zeros left after subtracting, and sort indices (canonical CSR).
+    """
+    counts = scipy.sparse.csr_matrix(counts)
+    counts.eliminate_zeros()
+    counts.sort_indices()
+    return counts
+
+
+def build_saved_model(simcalc, raw_paths=False):
+    """
+    Build the Markov model of all recordings that we save for predict-next.py.
+
+    States are paths without .so versions unless raw_paths. A prediction has
+    to be a file we can read, so for each state we predict the path opened
+    most often for it (like libc.so.6 for libc.so).
+    """
+    raw = simcalc.as_ids(remove_so_version=False)
+    samples = raw if raw_paths else simcalc.as_ids()
+    states, sequences = encode_samples(list(samples.values()))
+    counts = count_transitions(sequences, len(states))
+    files = None
+    if not raw_paths:
+        files = most_opened_files(simcalc.paths, list(raw.values()), states)
+    return TransitionModel.from_counts(
+        counts,
+        simcalc.paths.lookup(states),
+        remove_so_version=not raw_paths,
+        files=files,
+    )
+
+
+def most_opened_files(paths, samples, states):
+    """
+    Get the raw path opened most often for each normalized path id in states.
+
+    Ties go to the lower (first seen) path id.
+    """
+    ids = concatenate_arrays(samples, numpy.int64)
+    normalized = paths.normalize(ids).astype(numpy.int64)
+    pairs, counts = numpy.unique(normalized * len(paths) + ids, return_counts=True)
+    normal, raw = pairs // len(paths), pairs % len(paths)
+    order = numpy.lexsort((raw, -counts, normal))
+    normal, raw = normal[order], raw[order]
+    first = numpy.ones(len(normal), dtype=bool)
+    first[1:] = normal[1:] != normal[:-1]
+    best = dict(zip(normal[first].tolist(), raw[first].tolist()))
+    return paths.lookup([best[state] for state in numpy.asarray(states).tolist()])
+
+
+def encode_samples(samples):
+    """
+    Give each path id in the samples a dense state index.
+
+    Returns the path id of each state, and the samples as arrays of states.
     """
-    unique_paths = list(set([x for xs in train for x in xs]))
-
-    # Calculate mean of when path A goes to path B
-    # Double check numerics that setting 0 is OK - the corresponding probabilty
-    # of the state should be 0
-    time_in_states = {}
-
-    for paths in train:
-        last_path = None
-        # We can optimize here by just filling half (the diagonal)
-        for path in paths:
-            if last_path is None:
-                last_path = path
-                continue
-
-            # Get the mean across samples (always over 100 it seems, e.g., 115)
-            if last_path not in time_in_states:
-                time_in_states[last_path] = {}
-            # If we've already calculated for the combination, don't do it again
-            if path in time_in_states[last_path]:
-                continue
-            subset = df[df.normalized_path == path]
-            subset[subset.previous_path == last_path]
-            subset[subset.previous_path == last_path].ms_in_state
-            values = subset[subset.previous_path == last_path].ms_in_state
-            # I visualized this - most looks Poisson
-            mean_time = values.mean()
-            if numpy.isnan(mean_time):
-                mean_time = 0
-            time_in_states[last_path][path] = mean_time
-            last_path = path
-
-    ts_df = pandas.DataFrame(0, index=unique_paths, columns=unique_paths)
-    for path1, items in time_in_states.items():
-        for path2, time_in_state in items.items():
-            ts_df.loc[path1, path2] = time_in_state
-    return ts_df
-
-
-def build_transition_matrix(train):
-    """
-    Given paths for some training data, build a transition matrix
-    """
-    unique_paths = list(set([x for xs in train for x in xs]))
-    tm = pandas.DataFrame(0, columns=unique_paths, index=unique_paths)
-
-    # Now we iterate through the data and fill the matrix.
-    # First it's just a count, we will normalize so sum of row is 1
-    for paths in train:
-        last_path = None
-        # We can optimize here by just filling half (the diagonal)
-        for path in paths:
-            if last_path is None:
-                last_path = path
-                continue
-            tm.loc[last_path, path] += 1
-            last_path = path
-
-    # Make sure each row sums to 1
-    tm_norm = tm.div(tm.sum(axis=1), axis=0)
-    return tm_norm
+    ids = concatenate_arrays(samples, numpy.int32)
+    states, inverse = numpy.unique(ids, return_inverse=True)
+    splits = numpy.cumsum([len(sample) for sample in samples])[:-1]
+    return states, numpy.split(inverse.astype(numpy.int64), splits)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,726 @@
+#!/usr/bin/env python
+
+import hashlib
+import heapq
+import json
+import os
+
+import numpy
+import pandas
+
+from container_recorder import (
+    PathTable,
+    file_stamp,
+    pairwise_distances,
+    sequence_distance,
+)
+
+# Constants for mixing 64 bit hashes (splitmix64) and combining n-grams
+MIX_ADD = numpy.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLY1 = numpy.uint64(0xBF58476D1CE4E5B9)
+MIX_MULTIPLY2 = numpy.uint64(0x94D049BB133111EB)
+NGRAM_MULTIPLY = numpy.uint64(0x100000001B3)
+
+# Bump the version if signatures (or what they are computed from) change
+INDEX_VERSION = 1
+STORE_VERSION = 1
+TREE_VERSION = 1
+
+
+class MinHashIndex:
+    """
+    An approximate similarity index over recordings, with MinHash and LSH.
+
+    Each trace is a set of shingles (n-grams of consecutive paths), and its
+    signature is the minimum hash of its shingles under num_perm hash
+    functions. Two signatures agree at a position with probability equal to
+    the Jaccard similarity of the shingle sets. Signatures are split into
+    bands, and traces that agree on all of a band land in the same bucket,
+    so candidate pairs come from buckets instead of comparing every pair.
+
+    Paths are hashed by their string (not by id), so signatures don't depend
+    on what else was parsed, and can be saved and updated one file at a time.
+    """
+
+    def __init__(self, num_perm=128, bands=32, ngram=3, seed=0, operation="Open"):
+        if num_perm % bands:
+            raise ValueError(f"num_perm {num_perm} must be a multiple of bands {bands}")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.ngram = ngram
+        self.seed = seed
+        self.operation = operation
+        self.seeds = numpy.random.default_rng(seed).integers(
+            0, 2**64, size=num_perm, dtype=numpy.uint64
+        )
+        self.names = []
+        self.rows = {}
+        self.signatures = numpy.zeros((0, num_perm), dtype=numpy.uint64)
+        self.stamps = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def add(self, name, paths, stamp=None):
+        """
+        Add (or replace) the signature for a named list of paths.
+        """
+        self.add_signatures([name], [self.signature(paths)], [stamp])
+
+    def add_signatures(self, names, signatures, stamps):
+        """
+        Add (or replace) signatures, stacking all of the new ones at once.
+        """
+        added = []
+        for name, signature, stamp in zip(names, signatures, stamps):
+            if stamp is not None:
+                self.stamps[name] = stamp
+            row = self.rows.get(name)
+            if row is not None and row < len(self.signatures):
+                self.signatures[row] = signature
+                continue
+            if row is not None:
+                added[row - len(self.signatures)] = signature
+                continue
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+            added.append(signature)
+        if added:
+            self.signatures = numpy.vstack([self.signatures, numpy.array(added)])
+
+    def signature(self, paths):
+        """
+        Get the MinHash signature (num_perm uint64) for a list of paths.
+        """
+        shingles = path_shingles(paths, self.ngram)
+        signature = numpy.full(self.num_perm, numpy.iinfo(numpy.uint64).max)
+        for start in range(0, len(shingles), 4096):
+            chunk = shingles[start : start + 4096]
+            hashes = mix_hash(chunk[None, :] ^ self.seeds[:, None])
+            signature = numpy.minimum(signature, hashes.min(axis=1))
+        return signature.astype(numpy.uint64)
+
+    def update(self, traces):
+        """
+        Add signatures for the recordings of a Traces that are new or changed.
+
+        Traces are named by basename, like Traces.as_ids, and the stamp (size
+        and mtime) of the files is saved so we only parse and hash a file
+        again if it has changed.
+        """
+        groups = {}
+        for filename in traces.files:
+            groups.setdefault(os.path.basename(filename), []).append(filename)
+
+        names, signatures, stamps = [], [], []
+        for name, filenames in groups.items():
+            stamp = [list(file_stamp(filename)) for filename in filenames]
+            if name in self.rows and self.stamps.get(name) == stamp:
+                continue
+            paths = []
+            for filename in filenames:
+                recording = traces.store.get(filename)
+                ids = recording.select_ids(self.operation, remove_so_version=True)
+                paths += recording.paths.lookup(ids)
+            if paths:
+                names.append(name)
+                signatures.append(self.signature(paths))
+                stamps.append(stamp)
+        self.add_signatures(names, signatures, stamps)
+        return self
+
+    def band_keys(self, signatures=None):
+        """
+        Hash each band of each signature to one uint64 (shape traces x bands).
+        """
+        signatures = self.signatures if signatures is None else signatures
+        rows = self.num_perm // self.bands
+        bands = signatures.reshape(len(signatures), self.bands, rows)
+        keys = numpy.zeros(bands.shape[:2], dtype=numpy.uint64)
+        for column in range(rows):
+            keys = mix_hash(keys * NGRAM_MULTIPLY + bands[:, :, column])
+        return keys
+
+    def candidates(self):
+        """
+        Get (rows, columns) of candidate pairs (row < column) of self.names.
+
+        A pair is a candidate if the two share a bucket in any band. With b
+        bands of r rows, traces with Jaccard similarity s are candidates with
+        probability 1 - (1 - s^r)^b.
+        """
+        keys = self.band_keys()
+        firsts = []
+        seconds = []
+        for band in range(self.bands):
+            order = numpy.argsort(keys[:, band], kind="stable")
+            sorted_keys = keys[order, band]
+            bounds = numpy.flatnonzero(numpy.diff(sorted_keys)) + 1
+            for bucket in numpy.split(order, bounds):
+                if len(bucket) < 2:
+                    continue
+                rows, cols = numpy.triu_indices(len(bucket), k=1)
+                firsts.append(bucket[rows])
+                seconds.append(bucket[cols])
+        if not firsts:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return empty, empty
+
+        first = numpy.concatenate(firsts)
+        second = numpy.concatenate(seconds)
+        pairs = numpy.unique(
+            numpy.minimum(first, second) * len(self) + numpy.maximum(first, second)
+        )
+        return pairs // len(self), pairs % len(self)
+
+    def query(self, paths):
+        """
+        Get names of traces that share a bucket with a (new) list of paths.
+        """
+        keys = self.band_keys(self.signature(paths)[None, :])
+        matches = (self.band_keys() == keys).any(axis=1)
+        return [self.names[idx] for idx in numpy.flatnonzero(matches)]
+
+    def similarity(self, name1, name2):
+        """
+        Estimate the Jaccard similarity of two traces from their signatures.
+        """
+        signature1 = self.signatures[self.rows[name1]]
+        signature2 = self.signatures[self.rows[name2]]
+        return float((signature1 == signature2).mean())
+
+    def save(self, filename):
+        """
+        Save the index (a numpy .npz) so it can be loaded and updated later.
+        """
+        meta = {
+            "version": INDEX_VERSION,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "ngram": self.ngram,
+            "seed": self.seed,
+            "operation": self.operation,
+            "names": self.names,
+            "stamps": self.stamps,
+        }
+        with open(filename, "wb") as fd:
+            numpy.savez(fd, signatures=self.signatures, meta=json.dumps(meta))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a saved index. If it was saved by another version, it is empty.
+        """
+        with numpy.load(filename) as data:
+            meta = json.loads(str(data["meta"]))
+            signatures = data["signatures"]
+        index = cls(
+            num_perm=meta["num_perm"],
+            bands=meta["bands"],
+            ngram=meta["ngram"],
+            seed=meta["seed"],
+            operation=meta["operation"],
+        )
+        if meta["version"] == INDEX_VERSION:
+            index.names = meta["names"]
+            index.rows = {name: idx for idx, name in enumerate(index.names)}
+            index.signatures = signatures
+            index.stamps = meta["stamps"]
+        return index
+
+
+class DistanceStore:
+    """
+    A distance matrix saved in a directory, that grows one recording at a time.
+
+    Each distinct trace (by a hash of its paths) gets a row, in the order they
+    were added. Row i has the distances to rows 0 to i - 1, so the file is a
+    condensed lower triangle we can memory map and append rows to. Tags (the
+    recording names) point to the hash of their trace, so adding recordings
+    only computes distances for the new rows, and a recording that changes
+    only computes its own row again. The traces themselves are saved too, so
+    we can compare new recordings to old ones that aren't parsed this time.
+    """
+
+    def __init__(self, root, operation="Open", align=False):
+        self.root = root
+        self.operation = operation
+        self.align = align
+        self.meta_file = os.path.join(root, "store.json")
+        self.sequences_file = os.path.join(root, "sequences.npy")
+        self.distances_file = os.path.join(root, "distances.f32")
+        self.paths = PathTable()
+        self.tags = {}
+        self.slots = []
+        self.sequences = []
+        self.distances = numpy.zeros(0, dtype=numpy.float32)
+        self.load()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def load(self):
+        """
+        Load the store, if there is one for the same operation and alignment.
+        """
+        try:
+            with open(self.meta_file, "r") as fd:
+                meta = json.loads(fd.read())
+            if (
+                meta["version"] != STORE_VERSION
+                or meta["operation"] != self.operation
+                or meta["align"] != self.align
+            ):
+                return
+            count = len(meta["slots"])
+            if os.path.getsize(self.distances_file) != 4 * condensed_size(count):
+                return
+            ids = numpy.load(self.sequences_file)
+        except (OSError, ValueError, KeyError):
+            return
+
+        for path in meta["paths"]:
+            self.paths.add(path)
+        self.tags = meta["tags"]
+        self.slots = meta["slots"]
+        self.sequences = numpy.split(ids, numpy.cumsum(meta["lengths"])[:-1])
+        self.distances = self.open_distances(count)
+
+    def save(self):
+        """
+        Write the traces and index (the distances are already on disk).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        if isinstance(self.distances, numpy.memmap):
+            self.distances.flush()
+        meta = {
+            "version": STORE_VERSION,
+            "operation": self.operation,
+            "align": self.align,
+            "paths": self.paths.paths,
+            "tags": self.tags,
+            "slots": self.slots,
+            "lengths": [len(ids) for ids in self.sequences],
+        }
+        ids = numpy.concatenate(self.sequences or [[]]).astype(numpy.int32)
+        for path, write in [
+            (self.sequences_file, lambda fd: numpy.save(fd, ids)),
+            (self.meta_file, lambda fd: fd.write(json.dumps(meta).encode())),
+        ]:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as fd:
+                write(fd)
+            os.replace(tmp, path)
+
+    def open_distances(self, count):
+        """
+        Memory map the distances for count rows, growing the file if needed.
+        """
+        size = condensed_size(count)
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.distances_file, "ab"):
+            pass
+        os.truncate(self.distances_file, 4 * size)
+        if not size:
+            return numpy.zeros(0, dtype=numpy.float32)
+        return numpy.memmap(
+            self.distances_file, dtype=numpy.float32, mode="r+", shape=(size,)
+        )
+
+    def update(self, traces, workers=None):
+        """
+        Add the recordings of a Traces, computing only the distances we need.
+
+        Returns the tags (names, like Traces.distance_matrix) of the traces.
+        """
+        lookup = traces.as_paths(operation=self.operation)
+        for tag, paths in lookup.items():
+            self.tags[tag] = content_hash(paths)
+
+        # New traces take the row of a trace no tag uses anymore, or a new one
+        slot_of = {digest: idx for idx, digest in enumerate(self.slots)}
+        used = set(self.tags.values())
+        free = [idx for idx, digest in enumerate(self.slots) if digest not in used]
+        updated = []
+        for tag, paths in lookup.items():
+            digest = self.tags[tag]
+            if digest in slot_of:
+                continue
+            ids = numpy.array([self.paths.add(path) for path in paths], numpy.int32)
+            if free:
+                idx = free.pop(0)
+                self.slots[idx] = digest
+                self.sequences[idx] = ids
+            else:
+                idx = len(self.slots)
+                self.slots.append(digest)
+                self.sequences.append(ids)
+            slot_of[digest] = idx
+            updated.append(idx)
+
+        if updated:
+            del self.distances
+            self.distances = self.open_distances(len(self.slots))
+            rows, cols = updated_pairs(updated, len(self.slots))
+            self.distances[condensed_index(rows, cols)] = pairwise_distances(
+                [ids.tolist() for ids in self.sequences],
+                workers or traces.workers,
+                align=self.align,
+                pairs=(cols, rows),
+            )
+        self.save()
+        return list(lookup)
+
+    def distance_matrix(self, tags=None):
+        """
+        Get the distance matrix for tags (all of them by default).
+        """
+        tags = list(self.tags) if tags is None else list(tags)
+        slot_of = {digest: idx for idx, digest in enumerate(self.slots)}
+        slots = numpy.array([slot_of[self.tags[tag]] for tag in tags], dtype=int)
+        high = numpy.maximum(slots[:, None], slots[None, :])
+        low = numpy.minimum(slots[:, None], slots[None, :])
+        values = numpy.zeros(high.shape, dtype=numpy.float32)
+        different = high != low
+        values[different] = self.distances[
+            condensed_index(high[different], low[different])
+        ]
+        return pandas.DataFrame(values, index=tags, columns=tags)
+
+
+class VPTree:
+    """
+    A vantage point tree for nearest neighbor queries by edit distance.
+
+    Each node is a trace (the vantage point) and the median distance from it
+    to the traces under it. Traces within the median go inside, the rest go
+    outside. Edit distance is a metric, so by the triangle inequality a query
+    at distance d from a vantage point only needs the inside if d - tau is
+    within the median, and the outside if d + tau is past it (tau is the
+    distance we still care about), and most traces are never compared.
+
+    Recordings with the same trace are one item, and the tree is saved as
+    arrays with the traces, so it can be queried without the recordings.
+    """
+
+    def __init__(self, names, sequences, align=False, operation="Open", seed=0):
+        self.align = align
+        self.operation = operation
+        self.seed = seed
+
+        # One item per distinct trace, with all of the names that have it
+        self.items = []
+        self.names = []
+        seen = {}
+        for name, paths in zip(names, sequences):
+            key = tuple(paths)
+            if key not in seen:
+                seen[key] = len(self.items)
+                self.items.append(list(paths))
+                self.names.append([])
+            self.names[seen[key]].append(name)
+
+        count = len(self.items)
+        self.vantage = numpy.full(count, -1, dtype=numpy.int64)
+        self.radius = numpy.zeros(count, dtype=numpy.float64)
+        self.inside = numpy.full(count, -1, dtype=numpy.int64)
+        self.outside = numpy.full(count, -1, dtype=numpy.int64)
+        self.evaluations = 0
+        if count:
+            self.build()
+
+    def __len__(self):
+        return len(self.items)
+
+    @classmethod
+    def from_traces(cls, traces, operation="Open", align=False, seed=0):
+        """
+        Build a tree for the recordings of a Traces (named by basename).
+        """
+        lookup = traces.as_paths(operation=operation)
+        return cls(list(lookup), list(lookup.values()), align, operation, seed)
+
+    def distance(self, paths, item):
+        self.evaluations += 1
+        return sequence_distance(paths, self.items[item], self.align)
+
+    def build(self):
+        """
+        Build the nodes without recursion. Node i is stored at index i.
+        """
+        rng = numpy.random.default_rng(self.seed)
+        order = rng.permutation(len(self.items))
+        node = 0
+
+        # Each entry is (items under the node, parent node, is inside child)
+        stack = [(order, -1, True)]
+        while stack:
+            members, parent, inside = stack.pop()
+            if parent >= 0:
+                children = self.inside if inside else self.outside
+                children[parent] = node
+            vantage = members[0]
+            rest = members[1:]
+            self.vantage[node] = vantage
+            if len(rest):
+                distances = numpy.array(
+                    [self.distance(self.items[vantage], item) for item in rest]
+                )
+                radius = float(numpy.median(distances))
+                self.radius[node] = radius
+                within = distances <= radius
+                if (~within).any():
+                    stack.append((rest[~within], node, False))
+                if within.any():
+                    stack.append((rest[within], node, True))
+            node += 1
+
+    def search(self, paths, tau, visit):
+        """
+        Walk the tree for a query, calling visit(item, distance) on each node.
+
+        Tau is a function that gives the current search radius, so the k
+        nearest search can shrink it as it finds closer traces.
+        """
+        if not len(self.items):
+            return
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            distance = self.distance(paths, self.vantage[node])
+            visit(self.vantage[node], distance)
+            radius = self.radius[node]
+            inside, outside = self.inside[node], self.outside[node]
+
+            # Push the side the query is on last, so we look there first
+            near, far = (inside, outside) if distance <= radius else (outside, inside)
+            for child in (far, near):
+                if child < 0:
+                    continue
+                if child == inside and distance - tau() > radius:
+                    continue
+                if child == outside and distance + tau() <= radius:
+                    continue
+                stack.append(child)
+
+    def nearest(self, paths, k=1):
+        """
+        Get the k nearest recordings to a list of paths, as (name, distance).
+
+        Recordings with the same trace are tied, so we can return more than
+        k when the last distance is shared.
+        """
+        heap = []
+        count = [0]
+
+        def tau():
+            return -heap[0][0] if count[0] >= k else numpy.inf
+
+        def visit(item, distance):
+            if distance > tau():
+                return
+            heapq.heappush(heap, (-distance, item))
+            count[0] += len(self.names[item])
+            while count[0] - len(self.names[heap[0][1]]) >= k:
+                count[0] -= len(self.names[heapq.heappop(heap)[1]])
+
+        self.search(paths, tau, visit)
+        return self.expand(heap)
+
+    def within(self, paths, radius):
+        """
+        Get all recordings within radius of a list of paths, as (name, distance).
+        """
+        found = []
+
+        def visit(item, distance):
+            if distance <= radius:
+                found.append((-distance, item))
+
+        self.search(paths, lambda: radius, visit)
+        return self.expand(found)
+
+    def expand(self, found):
+        """
+        Turn (negative distance, item) into (name, distance), closest first.
+        """
+        results = []
+        for distance, item in sorted(found, key=lambda pair: (-pair[0], pair[1])):
+            results += [(name, int(-distance)) for name in self.names[item]]
+        return results
+
+    def save(self, filename):
+        """
+        Save the tree (a numpy .npz), with the traces it needs for queries.
+        """
+        paths = PathTable()
+        ids = [[paths.add(path) for path in item] for item in self.items]
+        meta = {
+            "version": TREE_VERSION,
+            "align": self.align,
+            "operation": self.operation,
+            "seed": self.seed,
+            "names": self.names,
+            "paths": paths.paths,
+            "lengths": [len(item) for item in ids],
+        }
+        with open(filename, "wb") as fd:
+            numpy.savez(
+                fd,
+                vantage=self.vantage,
+                radius=self.radius,
+                inside=self.inside,
+                outside=self.outside,
+                sequences=numpy.array(sum(ids, []), dtype=numpy.int32),
+                meta=json.dumps(meta),
+            )
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a saved tree, without building it again.
+        """
+        with numpy.load(filename) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["version"] != TREE_VERSION:
+                raise ValueError(f"{filename} was saved by another version")
+            tree = cls([], [], meta["align"], meta["operation"], meta["seed"])
+            for name in ["vantage", "radius", "inside", "outside"]:
+                setattr(tree, name, data[name])
+            ids = numpy.split(data["sequences"], numpy.cumsum(meta["lengths"])[:-1])
+        paths = meta["paths"]
+        tree.items = [[paths[idx] for idx in item.tolist()] for item in ids]
+        tree.names = meta["names"]
+        return tree
+
+
+def candidate_distances(
+    traces, index=None, workers=None, align=False, max_distance=None
+):
+    """
+    Compute exact distances for the LSH candidate pairs of a Traces.
+
+    The index is updated with any new or changed recordings first (and one
+    is made if not given). Returns a data frame of the two trace names, the
+    estimated Jaccard similarity and the edit distance, closest first.
+    """
+    index = (index if index is not None else MinHashIndex()).update(traces)
+    lookup = traces.as_ids(operation=index.operation)
+    names = list(lookup)
+    position = {name: idx for idx, name in enumerate(names)}
+
+    # Candidates are indices into the index, so map them to the traces
+    rows, cols = index.candidates()
+    keep = numpy.array(
+        [
+            index.names[row] in position and index.names[col] in position
+            for row, col in zip(rows.tolist(), cols.tolist())
+        ],
+        dtype=bool,
+    )
+    rows, cols = rows[keep], cols[keep]
+    first = numpy.array([position[index.names[row]] for row in rows], dtype=numpy.int64)
+    second = numpy.array(
+        [position[index.names[col]] for col in cols], dtype=numpy.int64
+    )
+    first, second = numpy.minimum(first, second), numpy.maximum(first, second)
+
+    sequences = [ids.tolist() for ids in lookup.values()]
+    distances = pairwise_distances(
+        sequences,
+        workers or traces.workers,
+        align=align,
+        max_distance=max_distance,
+        pairs=(first, second),
+    )
+    similarity = (index.signatures[rows] == index.signatures[cols]).mean(axis=1)
+    order = numpy.lexsort((second, first, distances))
+    return pandas.DataFrame(
+        {
+            "first": [names[idx] for idx in first[order]],
+            "second": [names[idx] for idx in second[order]],
+            "similarity": similarity[order],
+            "distance": distances[order].astype(int),
+        }
+    )
+
+
+def mix_hash(values):
+    """
+    Mix uint64 values into well spread uint64 hashes (splitmix64).
+    """
+    values = values + MIX_ADD
+    values = (values ^ (values >> numpy.uint64(30))) * MIX_MULTIPLY1
+    values = (values ^ (values >> numpy.uint64(27))) * MIX_MULTIPLY2
+    return values ^ (values >> numpy.uint64(31))
+
+
+def path_hashes(paths):
+    """
+    Hash each path string to a uint64 that is the same in every process.
+
+    Python's hash of a string is salted per process, so we use blake2b. Each
+    unique path is only hashed once.
+    """
+    hashes = {}
+    for path in paths:
+        if path not in hashes:
+            digest = hashlib.blake2b(path.encode(), digest_size=8).digest()
+            hashes[path] = int.from_bytes(digest, "little")
+    return numpy.array([hashes[path] for path in paths], dtype=numpy.uint64)
+
+
+def path_shingles(paths, ngram=3):
+    """
+    Get the unique hashes of n-grams of consecutive paths.
+
+    A trace shorter than ngram is a single shingle of all of its paths.
+    """
+    hashes = path_hashes(paths)
+    if not len(hashes):
+        return hashes
+    size = min(ngram, len(hashes))
+    count = len(hashes) - size + 1
+    shingles = numpy.zeros(count, dtype=numpy.uint64)
+    for offset in range(size):
+        shingles = shingles * NGRAM_MULTIPLY + hashes[offset : offset + count]
+    return numpy.unique(mix_hash(shingles))
+
+
+def content_hash(paths):
+    """
+    Hash a list of paths, so the same trace has the same key anywhere.
+    """
+    return hashlib.blake2b("\n".join(paths).encode(), digest_size=16).hexdigest()
+
+
+def condensed_size(count):
+    """
+    Number of distances between count rows (one per unique pair).
+    """
+    return count * (count - 1) // 2
+
+
+def condensed_index(rows, cols):
+    """
+    Index of the distance for rows > cols, when rows are appended in order.
+    """
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    return rows * (rows - 1) // 2 + numpy.asarray(cols, dtype=numpy.int64)
+
+
+def updated_pairs(updated, count):
+    """
+    Get (rows, columns), rows > columns, of all pairs with an updated row.
+    """
+    updated = numpy.array(sorted(updated), dtype=numpy.int64)
+    first = numpy.repeat(updated, count)
+    second = numpy.tile(numpy.arange(count, dtype=numpy.int64), len(updated))
+
+    # A pair of two updated rows is only done once
+    keep = (first != second) & (~numpy.isin(second, updated) | (second < first))
+    first, second = first[keep], second[keep]
+    return numpy.maximum(first, second), numpy.minimum(first, second)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Plain Python references and random inputs shared by the kernel tests
+
+import glob
+import os
+import random
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import container_recorder as recorder
+
+recording_dir = os.path.join(here, "..", "..", "recording")
+recordings = sorted(glob.glob(os.path.join(recording_dir, "*.out"))) + sorted(
+    glob.glob(os.path.join(here, "fs-record.log*"))
+)
+
+
+def levenshtein(paths1, paths2):
+    """
+    The full matrix Levenshtein distance (the original calculate_levenshtein).
+    """
+    len1, len2 = len(paths1), len(paths2)
+    matrix = [[0] * (len2 + 1) for _ in range(len1 + 1)]
+    for i in range(len1 + 1):
+        matrix[i][0] = i
+    for j in range(len2 + 1):
+        matrix[0][j] = j
+    for i in range(1, len1 + 1):
+        for j in range(1, len2 + 1):
+            cost = 0 if paths1[i - 1] == paths2[j - 1] else 1
+            matrix[i][j] = min(
+                matrix[i - 1][j] + 1,
+                matrix[i][j - 1] + 1,
+                matrix[i - 1][j - 1] + cost,
+            )
+    return matrix[-1][-1]
+
+
+def random_paths(rng, size, symbols):
+    """
+    A random sequence of paths, from few symbols so there is a lot to match.
+    """
+    return [f"/usr/lib/lib{rng.randrange(symbols)}.so" for _ in range(size)]
+
+
+def random_pairs(count=200, longest=40):
+    rng = random.Random(0)
+    pairs = []
+    for _ in range(count):
+        symbols = rng.choice([1, 2, 4, 16])
+        paths1 = random_paths(rng, rng.randrange(longest), symbols)
+        # Often the second is an edit of the first, like two runs of a release
+        if rng.random() < 0.5:
+            paths2 = list(paths1)
+            for _ in range(rng.randrange(6)):
+                at = rng.randrange(len(paths2) + 1)
+                if paths2 and rng.random() < 0.5:
+                    del paths2[min(at, len(paths2) - 1)]
+                else:
+                    paths2.insert(at, f"/opt/new{rng.randrange(symbols)}")
+        else:
+            paths2 = random_paths(rng, rng.randrange(longest), symbols)
+        pairs.append((paths1, paths2))
+    return pairs
+
+
+def recording_pairs():
+    """
+    Pairs of recordings (as path ids) that are neighbors in sorted order.
+    """
+    if not recordings:
+        return []
+    traces = recorder.Traces(recordings)
+    ids = list(traces.as_ids(fullpath=True).values())
+    return [(list(ids[i]), list(ids[i + 1])) for i in range(0, len(ids) - 1, 8)]
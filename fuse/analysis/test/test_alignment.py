@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Compare align_paths (filled by anti-diagonals, with a split traceback) with
+# the full matrix Needleman-Wunsch it replaced, on random inputs and on the
+# recordings. Run with: python -m pytest -q fuse/analysis/test
+
+import pytest
+from helpers import random_pairs, recorder, recording_pairs
+
+
+def needleman_wunsch(paths1, paths2, match_score=1, mismatch_score=-1, gap_penalty=-1):
+    """
+    The original align_paths, with the whole score matrix and its traceback.
+    """
+    rows = len(paths1) + 1
+    cols = len(paths2) + 1
+    matrix = [[0 for _ in range(cols)] for _ in range(rows)]
+    for i in range(1, rows):
+        matrix[i][0] = matrix[i - 1][0] + gap_penalty
+    for j in range(1, cols):
+        matrix[0][j] = matrix[0][j - 1] + gap_penalty
+    for i in range(1, rows):
+        for j in range(1, cols):
+            match = matrix[i - 1][j - 1] + (
+                match_score if paths1[i - 1] == paths2[j - 1] else mismatch_score
+            )
+            delete = matrix[i - 1][j] + gap_penalty
+            insert = matrix[i][j - 1] + gap_penalty
+            matrix[i][j] = max(match, delete, insert)
+
+    alignment1 = []
+    alignment2 = []
+    i = rows - 1
+    j = cols - 1
+    while i > 0 or j > 0:
+        if (
+            i > 0
+            and j > 0
+            and matrix[i][j]
+            == matrix[i - 1][j - 1]
+            + (match_score if paths1[i - 1] == paths2[j - 1] else mismatch_score)
+        ):
+            alignment1 = [paths1[i - 1]] + alignment1
+            alignment2 = [paths2[j - 1]] + alignment2
+            i -= 1
+            j -= 1
+        elif i > 0 and matrix[i][j] == matrix[i - 1][j] + gap_penalty:
+            alignment1 = [paths1[i - 1]] + alignment1
+            alignment2 = [""] + alignment2
+            i -= 1
+        else:
+            alignment1 = [""] + alignment1
+            alignment2 = [paths2[j - 1]] + alignment2
+            j -= 1
+    return alignment1, alignment2
+
+
+@pytest.fixture(scope="module")
+def pairs():
+    return random_pairs() + recording_pairs()
+
+
+@pytest.mark.parametrize("max_cells", [recorder.ALIGN_MAX_CELLS, 64, 1])
+def test_align_paths(pairs, max_cells):
+    for paths1, paths2 in pairs:
+        expected = needleman_wunsch(paths1, paths2)
+        assert recorder.align_paths(paths1, paths2, max_cells=max_cells) == expected
+
+
+def test_align_paths_scores(pairs):
+    for paths1, paths2 in pairs[:50]:
+        expected = needleman_wunsch(paths1, paths2, 2, -3, -2)
+        assert recorder.align_paths(paths1, paths2, 2, -3, -2, max_cells=32) == expected
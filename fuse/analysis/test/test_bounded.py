@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+# Compare bounded_edit_distance with the full matrix Levenshtein distance, for
+# bounds under, at and over it, on random inputs and on the recordings.
+# Run with: python -m pytest -q fuse/analysis/test
+
+import pytest
+from helpers import levenshtein, random_pairs, recorder, recording_pairs
+
+
+@pytest.fixture(scope="module")
+def pairs():
+    return random_pairs() + recording_pairs()
+
+
+def test_bounded_edit_distance(pairs):
+    for paths1, paths2 in pairs:
+        expected = levenshtein(paths1, paths2)
+        for max_distance in [0, 1, 3, expected, expected + 2]:
+            found = recorder.bounded_edit_distance(paths1, paths2, max_distance)
+            assert found == min(expected, max_distance + 1)
+
+
+def test_edit_distance_stops_over(pairs):
+    # Stopping early gives some score over the bound, and never stops under it
+    for paths1, paths2 in pairs:
+        expected = levenshtein(paths1, paths2)
+        for max_distance in [0, 2, expected - 1, expected]:
+            if max_distance < 0:
+                continue
+            found = recorder.edit_distance(paths1, paths2, max_distance)
+            if expected > max_distance:
+                assert max_distance < found <= expected
+            else:
+                assert found == expected
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Check that cached recordings load as the same columns we parsed, memory
+# mapped one file per column, and that a changed recording is parsed again.
+# Run with: python -m pytest -q fuse/analysis/test
+
+import os
+import shutil
+
+import numpy
+import pytest
+from helpers import recorder, recordings
+
+columns = ["timestamps", "operations", "path_ids"]
+
+
+@pytest.fixture
+def recording(tmp_path):
+    if not recordings:
+        pytest.skip("There are no recordings")
+    filename = tmp_path / os.path.basename(recordings[0])
+    shutil.copy(recordings[0], filename)
+    return str(filename)
+
+
+def test_cache_columns(recording, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    stamp = recorder.file_stamp(recording)
+    parsed = recorder.read_recording(recording, stamp, cache=True, cache_dir=cache_dir)
+    cached = recorder.read_cache(recording, stamp, cache_dir)
+    assert cached is not None
+    for column in columns:
+        values = getattr(cached, column)
+        assert isinstance(values, numpy.memmap)
+        assert values.strides == (values.itemsize,)
+        assert numpy.array_equal(values, getattr(parsed, column))
+    assert cached.paths.paths == parsed.paths.paths
+    assert cached.functions == parsed.functions
+
+
+def test_cache_stale(recording, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    stamp = recorder.file_stamp(recording)
+    recorder.read_recording(recording, stamp, cache=True, cache_dir=cache_dir)
+    with open(recording, "a") as fd:
+        fd.write("2024/11/08 10:46:19 recorder.go:46: 1 Open /etc/new\n")
+    changed = recorder.file_stamp(recording)
+    assert recorder.read_cache(recording, changed, cache_dir) is None
+
+    # Reading again parses the new events and replaces the cache
+    parsed = recorder.read_recording(
+        recording, changed, cache=True, cache_dir=cache_dir
+    )
+    assert parsed.paths[parsed.path_ids[-1]] == "/etc/new"
+    cached = recorder.read_cache(recording, changed, cache_dir)
+    assert len(cached) == len(parsed)
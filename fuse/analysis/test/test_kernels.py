@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+# Compare the bit-parallel and anti-diagonal edit distances in container_recorder
+# with the full matrix Levenshtein distance they replaced, on random inputs and
+# on the recordings. Run with: python -m pytest -q fuse/analysis/test
+
+import numpy
+import pytest
+from helpers import levenshtein, random_pairs, recorder, recording_pairs
+
+
+@pytest.fixture(scope="module")
+def pairs():
+    return random_pairs() + recording_pairs()
+
+
+def test_edit_distance(pairs):
+    for paths1, paths2 in pairs:
+        expected = levenshtein(paths1, paths2)
+        assert recorder.edit_distance(paths1, paths2) == expected
+        assert recorder.calculate_levenshtein(paths1, paths2) == expected
+        assert recorder.diagonal_edit_distance(paths1, paths2) == expected
+
+
+def test_edit_distance_arrays(pairs):
+    for paths1, paths2 in pairs[-20:]:
+        expected = levenshtein(paths1, paths2)
+        array1, array2 = numpy.array(paths1), numpy.array(paths2)
+        assert recorder.edit_distance(array1, array2) == expected
+        assert recorder.diagonal_edit_distance(array1, array2) == expected
+
+
+def test_edit_distance_unhashable():
+    # Lists aren't hashable, so these go to diagonal_edit_distance
+    for paths1, paths2 in random_pairs(count=50, longest=15):
+        list1 = [[path] for path in paths1]
+        list2 = [[path] for path in paths2]
+        assert recorder.edit_distance(list1, list2) == levenshtein(paths1, paths2)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# Check the models in run-models.py against building them the slow way, and
+# on short (or empty) traces. Run with: python -m pytest -q fuse/analysis/test
+
+import collections
+import importlib.util
+import os
+
+import numpy
+import pandas
+import pytest
+import scipy.sparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location(
+    "run_models", os.path.join(here, "..", "run-models.py")
+)
+models = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(models)
+
+
+def test_sparse_entries():
+    rng = numpy.random.default_rng(0)
+    dense = rng.integers(0, 3, size=(6, 5)) * rng.random((6, 5))
+    matrix = scipy.sparse.csr_matrix(dense)
+    rows, columns = rng.integers(0, 6, size=40), rng.integers(0, 5, size=40)
+    found = models.sparse_entries(matrix, rows, columns)
+    assert numpy.array_equal(found, dense[rows, columns])
+    assert len(models.sparse_entries(matrix, [], [])) == 0
+
+
+def test_evaluate_one_event():
+    tm = models.build_transition_matrix([numpy.array([0, 1, 2, 0])], 3)
+    scores = models.evaluate_markov(tm, numpy.array([1]))
+    assert scores == {"predictions": 0, "expected": 0.0, "top-1": 0, "top-3": 0}
+    results = models.test_markov(tm, numpy.array([1]))
+    assert results["correct"] == 0 and results["wrong"] == 0
+
+
+def test_ngram_one_event():
+    samples = [numpy.array([0, 1, 2, 0]), numpy.array([1])]
+    trie = models.PathTrie(samples, 3, order=2)
+    matrix, totals = trie.fold_matrix([1])
+    results, scores = models.test_ngram(trie, matrix, totals, 1)
+    assert results == {"correct": 0, "wrong": 0}
+    assert scores["predictions"] == 0 and scores["top-1"] == 0
+
+
+def random_samples(rng, count=12, nstates=8, longest=30):
+    """
+    Random traces of states, with some of one event (no transitions).
+    """
+    return [
+        rng.integers(0, nstates, size=rng.integers(1, longest)) for _ in range(count)
+    ]
+
+
+def random_frame(rng, samples):
+    """
+    A transition_frame for samples, with random times (the last has none).
+    """
+    frames = []
+    for idx, states in enumerate(samples):
+        times = rng.integers(0, 50, size=len(states) - 1).astype(float)
+        if len(times):
+            times[-1] = numpy.nan
+        frames.append(
+            pandas.DataFrame(
+                {
+                    "basename": f"trace-{idx}",
+                    "previous": states[:-1],
+                    "next": states[1:],
+                    "ms_in_state": times,
+                }
+            )
+        )
+    return pandas.concat(frames, ignore_index=True)
+
+
+def test_markov_times_no_correct():
+    tm = models.build_transition_matrix([numpy.array([0, 1, 2, 0])], 3)
+    ts = scipy.sparse.csr_matrix(numpy.ones((3, 3)))
+    rows = pandas.DataFrame({"previous": [2], "next": [1], "ms_in_state": [1.0]})
+    rng = numpy.random.default_rng(0)
+    states, means, actual = models.build_and_test_markov_with_times(
+        tm, ts, numpy.array([2, 1]), rows, 3, rng
+    )
+    assert len(states) == len(means) == len(actual) == 0
+
+    empty = scipy.sparse.csr_matrix((3, 3))
+    assert models.timeseries_mean(empty, empty).nnz == 0
+
+
+def test_markov_times():
+    # Compare with looking up each correct transition in the data frame
+    rng = numpy.random.default_rng(1)
+    nstates = 6
+    samples = random_samples(rng, nstates=nstates)
+    frame = random_frame(rng, samples)
+    names = [f"trace-{idx}" for idx in range(len(samples))]
+    times = models.count_times(frame, names, nstates)
+    tm = models.build_transition_matrix(samples, nstates)
+    ts = models.timeseries_mean(
+        models.sum_counts([sums for sums, _ in times]),
+        models.sum_counts([counts for _, counts in times]),
+    )
+    dense = ts.toarray()
+    for name, test in zip(names, samples):
+        rows = frame[frame.basename == name]
+        found = models.build_and_test_markov_with_times(
+            tm, ts, test, rows, nstates, numpy.random.default_rng(2)
+        )
+        results = models.test_markov(tm, test, numpy.random.default_rng(2))
+        expected = []
+        for previous, following in results["transitions-correct"]:
+            if previous == following:
+                continue
+            subset = rows[(rows.previous == previous) & (rows.next == following)]
+            actual = subset.ms_in_state.to_numpy()[0]
+            if not numpy.isnan(actual):
+                expected.append((previous, dense[previous, following], actual))
+        assert list(zip(*[column.tolist() for column in found])) == expected
+
+
+def test_subtracted_folds():
+    # A fold's counts are the total minus the held out samples, which should
+    # be exactly the matrices we'd get counting the rest of the samples again
+    rng = numpy.random.default_rng(3)
+    nstates = 7
+    samples = random_samples(rng, count=15, nstates=nstates)
+    frame = random_frame(rng, samples)
+    names = [f"trace-{idx}" for idx in range(len(samples))]
+    transitions = [models.count_transitions([sample], nstates) for sample in samples]
+    total = models.sum_counts(transitions)
+    times = models.count_times(frame, names, nstates)
+    total_sums = models.sum_counts([sums for sums, _ in times])
+    total_counts = models.sum_counts([counts for _, counts in times])
+
+    for held_out in models.iter_folds(len(samples), 4, rng):
+        rest = [idx for idx in range(len(samples)) if idx not in held_out]
+        fold = models.subtract_counts(total, transitions, held_out)
+        rebuilt = models.count_transitions([samples[idx] for idx in rest], nstates)
+        assert (fold != rebuilt).nnz == 0
+
+        # The same draws give the same predictions
+        tm = models.normalize_rows(fold)
+        expected = models.build_transition_matrix(
+            [samples[idx] for idx in rest], nstates
+        )
+        for idx in held_out:
+            found = models.test_markov(tm, samples[idx], numpy.random.default_rng(4))
+            again = models.test_markov(
+                expected, samples[idx], numpy.random.default_rng(4)
+            )
+            assert found == again
+
+        # And the fold's times are the times of the rest
+        sums = models.subtract_counts(total_sums, [s for s, _ in times], held_out)
+        counts = models.subtract_counts(total_counts, [c for _, c in times], held_out)
+        rest_times = models.count_times(frame, [names[idx] for idx in rest], nstates)
+        assert (sums != models.sum_counts([s for s, _ in rest_times])).nnz == 0
+        assert (counts != models.sum_counts([c for _, c in rest_times])).nnz == 0
+
+
+def test_timeseries_matrix():
+    # Compare with the times of each (previous, next) pair one at a time
+    rng = numpy.random.default_rng(5)
+    nstates = 6
+    samples = random_samples(rng, count=10, nstates=nstates)
+    frame = random_frame(rng, samples)
+    stats = models.build_timeseries_matrix(frame, nstates)
+    dense = {name: matrix.toarray() for name, matrix in stats.items()}
+    timed = frame.dropna(subset=["ms_in_state"])
+    for previous in range(nstates):
+        for following in range(nstates):
+            times = timed.ms_in_state[
+                (timed.previous == previous) & (timed.next == following)
+            ].to_numpy()
+            assert dense["count"][previous, following] == len(times)
+            if not len(times):
+                continue
+            assert numpy.isclose(dense["mean"][previous, following], times.mean())
+            variance = times.var(ddof=1) if len(times) > 1 else 0
+            assert numpy.isclose(dense["var"][previous, following], variance)
+            median = numpy.quantile(times, 0.5)
+            assert numpy.isclose(dense["q50"][previous, following], median)
+
+
+def test_fold_timeseries_mean():
+    # A fold's mean from subtracted sums and counts is the mean of its rows
+    rng = numpy.random.default_rng(6)
+    nstates = 6
+    samples = random_samples(rng, count=10, nstates=nstates)
+    frame = random_frame(rng, samples)
+    names = [f"trace-{idx}" for idx in range(len(samples))]
+    times = models.count_times(frame, names, nstates)
+    sums = [s for s, _ in times]
+    counts = [c for _, c in times]
+    for held_out in models.iter_folds(len(samples), 3, rng):
+        means = models.timeseries_mean(
+            models.subtract_counts(models.sum_counts(sums), sums, held_out),
+            models.subtract_counts(models.sum_counts(counts), counts, held_out),
+        )
+        rest = frame[~frame.basename.isin([names[idx] for idx in held_out])]
+        expected = models.build_timeseries_matrix(rest, nstates)["mean"]
+        assert numpy.allclose(means.toarray(), expected.toarray())
+
+
+def ngram_probabilities(train, test, order):
+    """
+    Predict each state (but the first) of test by counting n-grams in train.
+
+    Every position counts for the contexts (up to order states before it)
+    it has, and we use the longest context that was seen.
+    """
+    counts = collections.Counter()
+    totals = collections.Counter()
+    for states in train:
+        states = states.tolist()
+        for position, state in enumerate(states):
+            for depth in range(min(position, order) + 1):
+                context = tuple(states[position - depth : position])
+                counts[context, state] += 1
+                totals[context] += 1
+    probabilities = []
+    states = test.tolist()
+    for position in range(1, len(states)):
+        for depth in range(min(position, order), -1, -1):
+            context = tuple(states[position - depth : position])
+            if totals[context]:
+                break
+        probabilities.append(counts[context, states[position]] / totals[context])
+    return probabilities
+
+
+def test_ngram_probabilities():
+    rng = numpy.random.default_rng(7)
+    samples = random_samples(rng, count=15, nstates=4)
+    for order in [1, 2, 3]:
+        trie = models.PathTrie(samples, 4, order)
+        for held_out in models.iter_folds(len(samples), 5, rng):
+            matrix, totals = trie.fold_matrix(held_out)
+            train = [s for idx, s in enumerate(samples) if idx not in held_out]
+            for idx in held_out:
+                contexts, following = trie.backoff(idx, totals)
+                found = models.sparse_entries(matrix, contexts, following)
+                expected = ngram_probabilities(train, samples[idx], order)
+                assert numpy.allclose(found, expected)
+
+
+def test_ngram_order_one():
+    # With every previous state seen, order 1 is the Markov model
+    rng = numpy.random.default_rng(8)
+    nstates = 6
+    samples = random_samples(rng, count=10, nstates=nstates)
+    trie = models.PathTrie(samples, nstates, order=1)
+    matrix, totals = trie.fold_matrix([])
+    tm = models.build_transition_matrix(samples, nstates)
+    for idx, sample in enumerate(samples):
+        results, scores = models.test_ngram(
+            trie, matrix, totals, idx, numpy.random.default_rng(9)
+        )
+        expected = models.test_markov(tm, sample, numpy.random.default_rng(9))
+        assert results["correct"] == expected["correct"]
+        markov = models.evaluate_markov(tm, sample)
+        assert scores.pop("expected") == pytest.approx(markov.pop("expected"))
+        assert scores == markov
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Compare the vectorized recording parser with splitting each line (like the
+# original iter_events), on random recordings and the real ones.
+# Run with: python -m pytest -q fuse/analysis/test
+
+import os
+import random
+
+import numpy
+import pytest
+from helpers import recorder, recordings
+
+
+def split_lines(data):
+    """
+    Parse a recording one line at a time (like the original iter_events).
+    """
+    events = []
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if len(fields) < 3 or not fields[-3].isdigit():
+            continue
+        events.append((int(fields[-3]), fields[-2].decode(), fields[-1].decode()))
+    return events
+
+
+def random_recording(rng):
+    """
+    Bytes of a random recording, with the kinds of lines the recorder writes
+    and some it shouldn't (blank, partial, or no timestamp).
+    """
+    names = ["Lookup", "Open", "Close", "Complete", "Read", "Getattr"]
+    lines = []
+    for _ in range(rng.randrange(60)):
+        kind = rng.random()
+        space = rng.choice([" ", "  ", "\t", "     "])
+        if kind < 0.1:
+            lines.append(rng.choice(["", " ", "\r", "noise"]))
+            continue
+        timestamp = str(rng.randrange(10 ** rng.randrange(1, 19)))
+        if kind < 0.2:
+            timestamp = rng.choice(["12ab", "-5", "x"])
+        path = "/" + "/".join(
+            "".join(
+                rng.choice("abcxyz.-_0123456789") for _ in range(rng.randrange(1, 12))
+            )
+            for _ in range(rng.randrange(1, 6))
+        )
+        fields = [timestamp, rng.choice(names), path]
+        if rng.random() < 0.8:
+            fields = ["2024/11/08", "10:46:19", "recorder.go:46:"] + fields
+        lines.append(space.join(fields) + rng.choice(["", " ", "\r"]))
+    text = "\n".join(lines)
+    if rng.random() < 0.5:
+        text += "\n"
+    return text.encode()
+
+
+def parsed_events(recording):
+    return [
+        (int(timestamp), recording.functions[code], recording.paths[path_id])
+        for timestamp, code, path_id in zip(
+            recording.timestamps, recording.operations, recording.path_ids
+        )
+    ]
+
+
+def test_parse_buffer():
+    rng = random.Random(0)
+    for _ in range(500):
+        data = random_recording(rng)
+        buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+        recording = recorder.parse_buffer("random.out", buffer)
+        assert parsed_events(recording) == split_lines(data)
+
+
+@pytest.mark.parametrize("filename", recordings, ids=os.path.basename)
+def test_parse_recording(filename):
+    with open(filename, "rb") as fd:
+        data = fd.read()
+    recording = recorder.parse_recording(filename)
+    assert parsed_events(recording) == split_lines(data)
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_any_function(tmp_path, cache):
+    # Functions aren't a fixed list, so we can select (and cache) any of them
+    filename = tmp_path / "x.out"
+    filename.write_text(
+        "2024/11/08 10:46:19 recorder.go:46: 1 Open /etc/a\n"
+        "2024/11/08 10:46:19 recorder.go:46: 2 Read /etc/a\n"
+    )
+    cache_dir = str(tmp_path / "cache") if cache else None
+    for _ in range(2):
+        traces = recorder.Traces([str(filename)], cache_dir=cache_dir)
+        assert traces.as_paths(operation="Read") == {"x.out": ["/etc/a"]}
+        assert traces.as_paths(operation="Write") == {}
+    if cache:
+        assert os.listdir(cache_dir)
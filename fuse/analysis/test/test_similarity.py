@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Check that the DistanceStore keeps the same distances as computing them all
+# again, and only computes the row of a recording that changed.
+# Run with: python -m pytest -q fuse/analysis/test
+
+import os
+import shutil
+
+import numpy
+import pytest
+from helpers import recorder, recording_dir
+
+import similarity
+
+names = [
+    "lammps-patch_10Feb2021.out",
+    "lammps-patch_14Dec2021.out",
+    "lammps-patch_15Apr2020.out",
+    "lammps-patch_15Jun2023.out",
+]
+
+
+@pytest.fixture
+def copies(tmp_path):
+    filenames = []
+    for name in names:
+        filename = os.path.join(recording_dir, name)
+        if not os.path.exists(filename):
+            pytest.skip(f"There is no recording {name}")
+        filenames.append(str(tmp_path / name))
+        shutil.copy(filename, filenames[-1])
+    return filenames
+
+
+@pytest.fixture
+def computed(monkeypatch):
+    """
+    Count the pairs the store computes distances for.
+    """
+    counts = []
+    pairwise_distances = similarity.pairwise_distances
+
+    def counted(sequences, workers=None, align=False, pairs=None, **kwargs):
+        counts.append(len(pairs[0]))
+        return pairwise_distances(
+            sequences, workers, align=align, pairs=pairs, **kwargs
+        )
+
+    monkeypatch.setattr(similarity, "pairwise_distances", counted)
+    return counts
+
+
+def expected_matrix(filenames):
+    matrix = recorder.Traces(filenames).distance_matrix()
+    return list(matrix.index), matrix.to_numpy()
+
+
+def test_store_changed(copies, tmp_path, computed):
+    root = str(tmp_path / "store")
+    tags = similarity.DistanceStore(root).update(recorder.Traces(copies))
+    expected_tags, expected = expected_matrix(copies)
+    assert tags == expected_tags
+    found = similarity.DistanceStore(root).distance_matrix(tags)
+    assert numpy.array_equal(found.to_numpy(), expected)
+    assert computed == [len(copies) * (len(copies) - 1) // 2]
+
+    # Nothing changed, so nothing is computed
+    similarity.DistanceStore(root).update(recorder.Traces(copies))
+    assert len(computed) == 1
+
+    # One recording changed, so only its row is computed again
+    with open(copies[1], "a") as fd:
+        fd.write("2024/11/08 10:46:19 recorder.go:46: 1 Open /etc/new\n")
+    store = similarity.DistanceStore(root)
+    store.update(recorder.Traces(copies))
+    assert computed[1:] == [len(copies) - 1]
+    _, expected = expected_matrix(copies)
+    assert numpy.array_equal(store.distance_matrix(tags).to_numpy(), expected)
+    assert len(store) == len(copies)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# Check that the TraceStore parses each recording once, again when it changes,
+# and the same in a process pool as one at a time.
+# Run with: python -m pytest -q fuse/analysis/test
+
+import os
+import shutil
+
+import numpy
+import pytest
+from helpers import recorder, recordings
+
+columns = ["timestamps", "operations", "path_ids"]
+
+
+def same_recordings(first, second):
+    for one, two in zip(first, second):
+        assert one.filename == two.filename
+        assert one.functions == two.functions
+        for column in columns:
+            assert numpy.array_equal(getattr(one, column), getattr(two, column))
+
+
+@pytest.fixture
+def copies(tmp_path):
+    if len(recordings) < 3:
+        pytest.skip("There aren't enough recordings")
+    filenames = []
+    for filename in recordings[:3]:
+        filenames.append(str(tmp_path / os.path.basename(filename)))
+        shutil.copy(filename, filenames[-1])
+    return filenames
+
+
+def test_parallel_parse():
+    serial = recorder.TraceStore()
+    parallel = recorder.TraceStore()
+    same_recordings(serial.load(recordings), parallel.load(recordings, workers=2))
+    assert serial.paths.paths == parallel.paths.paths
+
+    # And so everything built from path ids is the same
+    ids = recorder.Traces(recordings).as_ids()
+    found = recorder.Traces(recordings, workers=2).as_ids()
+    assert list(ids) == list(found)
+    assert all(numpy.array_equal(ids[name], found[name]) for name in ids)
+
+
+def test_parallel_parse_cache(copies, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    serial = recorder.TraceStore().load(copies)
+    parallel = recorder.TraceStore(cache_dir=cache_dir).load(copies, workers=2)
+    cached = recorder.TraceStore(cache_dir=cache_dir).load(copies, workers=2)
+    same_recordings(serial, parallel)
+    same_recordings(serial, cached)
+
+
+def test_store_changed(copies):
+    store = recorder.TraceStore()
+    traces = recorder.Traces(copies, store=store)
+    before = traces.as_paths(remove_so_version=False)
+    first = store.get(copies[0])
+    assert store.get(copies[0]) is first
+
+    # A new event changes the size, so the file is parsed again
+    with open(copies[0], "a") as fd:
+        fd.write("2024/11/08 10:46:19 recorder.go:46: 1 Open /etc/new\n")
+    assert store.get(copies[0]) is not first
+    after = traces.as_paths(remove_so_version=False)
+    name = os.path.basename(copies[0])
+    assert after[name] == before[name] + ["/etc/new"]
+    assert all(after[key] == before[key] for key in before if key != name)
+
+    # And invalidate forgets a recording even if it didn't change
+    second = store.get(copies[1])
+    store.invalidate(copies[1])
+    assert copies[1] not in store
+    assert store.get(copies[1]) is not second